@@ -0,0 +1,88 @@
+"""Overhead of the `Cache` decorator on the hit path compared to
+`functools.lru_cache` and to a plain wrapper going through the public
+`Cache` methods. With a dict as the storage the timings show the cost
+of the decorator itself.
+
+The best of `repeat` runs is reported as the timings are noisy.
+
+Usage: python benchmarks/decorator_overhead.py [number] [repeat]
+"""
+import sys
+import timeit
+from functools import lru_cache, wraps
+
+from caching import Cache, MemoryStorage
+from caching.cache import MISS, _function_name
+from caching.storage import CacheStorageBase
+
+
+def func(a, b=1):
+    return a + b
+
+
+class DictStorage(CacheStorageBase):
+    """The cheapest possible storage, leaving the cost of the decorator
+    itself."""
+
+    def __init__(self):
+        super().__init__(maxsize=-1, ttl=-1, policy='FIFO')
+        self.items = {}
+
+    def get(self, key, default=None):
+        return self.items.get(key, default)
+
+    def set(self, key, value, tag=None):
+        self.items[key] = value
+
+
+def generic_wrapper(cache, fn):
+    key_prefix = _function_name(fn)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (key_prefix, *cache.make_key(*args, **kwargs))
+        res = cache.get(key, MISS)
+        if res is MISS:
+            res = fn(*args, **kwargs)
+            cache.set(key, res, tag=key_prefix)
+        return res
+
+    return wrapper
+
+
+def main(number=100000, repeat=7):
+    candidates = {
+        'no cache': func,
+        'functools.lru_cache': lru_cache(maxsize=1024)(func),
+        'generic wrapper': generic_wrapper(Cache(), func),
+        'Cache()': Cache()(func),
+        'Cache(policy=LRU)': Cache(policy='LRU')(func),
+        'Cache(key=custom)': Cache(key=lambda *a, **kw: (a, kw.get('b')))(func),
+        # Without the SQLite lookup, which dominates the timings above
+        'generic wrapper, memory': generic_wrapper(
+            Cache(storage=MemoryStorage()), func,
+        ),
+        'Cache(storage=memory)': Cache(storage=MemoryStorage())(func),
+        'generic wrapper, dict': generic_wrapper(
+            Cache(storage=DictStorage()), func,
+        ),
+        'Cache(storage=dict)': Cache(storage=DictStorage())(func),
+    }
+    calls = {
+        'positional': lambda f: f(1),
+        'keyword': lambda f: f(1, b=2),
+    }
+    for call_name, call in calls.items():
+        for name, f in candidates.items():
+            call(f)  # warm up the cache
+            seconds = min(timeit.repeat(
+                lambda: call(f), number=number, repeat=repeat,
+            ))
+            print(
+                f'{call_name:>10} {name:>24}: '
+                f'{seconds / number * 1e6:8.3f} us per call'
+            )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""Memory taken per item by `MemoryStorage` and by an in-memory
+`SQLiteStorage`, as reported by `memory_usage`, for several value sizes.
+
+The keys are pickled (function name, int) tuples like the keys of
+the decorated functions, about 30 bytes.
+
+Usage: python benchmarks/memory_usage.py [number]
+"""
+import pickle
+import sys
+
+from caching import MemoryStorage, SQLiteStorage
+
+
+def per_item(storage, number, value_size):
+    empty = storage.memory_usage()
+    value = b'x' * value_size
+    for i in range(number):
+        storage.set(pickle.dumps(('module.func', i)), value, tag='module.func')
+    return (storage.memory_usage() - empty) / number
+
+
+def main(number=20000):
+    candidates = {
+        'MemoryStorage(policy=FIFO)': lambda: MemoryStorage(
+            maxsize=number, ttl=-1, policy='FIFO',
+        ),
+        'MemoryStorage(policy=LFU)': lambda: MemoryStorage(
+            maxsize=number, ttl=-1, policy='LFU',
+        ),
+        'SQLiteStorage(:memory:)': lambda: SQLiteStorage(
+            filepath=':memory:', maxsize=number, ttl=-1,
+        ),
+    }
+    for value_size in (20, 200, 2000):
+        for name, make in candidates.items():
+            storage = make()
+            print(
+                f'{value_size:>5} B values {name:>28}: '
+                f'{per_item(storage, number, value_size):8.0f} B per item'
+            )
+            storage.close()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,7 +1,15 @@
 from .cache import Cache
+from .cluster import ClusterStorage
+from .keys import fingerprint_key, identity_key
+from .memory import MemoryStorage
+from .refresh import Refresher
+from .remote import RemoteStorage
 from .storage import CacheStorageBase, SQLiteStorage
 
 
 __version__ = '0.1.dev8'
 
-__all__ = (Cache, CacheStorageBase, SQLiteStorage)
+__all__ = (
+    Cache, CacheStorageBase, ClusterStorage, MemoryStorage, SQLiteStorage,
+    RemoteStorage, Refresher, fingerprint_key, identity_key,
+)
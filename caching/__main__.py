@@ -0,0 +1,41 @@
+"""Command line tools.
+
+Show the stats of the functions decorated by a file-based cache with
+`stats=True`::
+
+    python -m caching stats /path/to/cachefile
+"""
+import argparse
+import os
+import sys
+
+from .stats import format_report, read_stats
+
+
+def stats(args):
+    if not os.path.isfile(args.filepath):
+        print(f'No such file: {args.filepath}', file=sys.stderr)
+        return 1
+    report = read_stats(args.filepath)
+    if not report:
+        print(f'No stats in {args.filepath}', file=sys.stderr)
+        return 1
+    print(format_report(report))
+    return 0
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m caching')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    stats_parser = subparsers.add_parser(
+        'stats', help='Show the stats of the cached functions.',
+    )
+    stats_parser.add_argument('filepath', help='Cache file path.')
+    stats_parser.set_defaults(func=stats)
+    args = parser.parse_args(args)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,43 @@
+import atexit
+import os
 import pickle
+import time
+import weakref
 from collections import OrderedDict
-from functools import wraps
-from typing import Union, Callable
+from contextlib import suppress
+from functools import partial, update_wrapper, wraps
+from itertools import chain
+from types import MethodType
+from typing import Dict, Union, Callable, Tuple
 
-from .storage import SQLiteStorage
+from .keys import MethodKey, make_key
+from .refresh import Refresher
+from .stats import FunctionStats
+from .storage import CacheStorageBase, SQLiteStorage
 
 MISS = object()
 
+_stats_caches = weakref.WeakSet()
 
-def make_key(*args, **kwargs):
-    if kwargs:
-        return (args, *(x for kv in sorted(kwargs.items()) for x in kv))
-    else:
-        return args
+
+@atexit.register
+def _save_stats_at_exit():
+    for cache in list(_stats_caches):
+        with suppress(Exception):
+            cache.save_stats()
+
+
+def _reset_stats_after_fork():
+    # The stats collected before the fork are saved by the parent process.
+    # The counters are reset in place, the decorated functions refer to them.
+    for cache in list(_stats_caches):
+        for stats in cache.function_stats.values():
+            stats.take()
+        cache.stats_saved = time.monotonic()
+
+
+if hasattr(os, 'register_at_fork'):  # Python 3.7+
+    os.register_at_fork(after_in_child=_reset_stats_after_fork)
 
 
 def _type_names(args, kwargs):
@@ -30,11 +55,43 @@ def _function_name(fn):
     return f'{fn.__module__}.{fn.__qualname__}'
 
 
+def _tag_name(tag):
+    return tag if tag is None or isinstance(tag, str) else _function_name(tag)
+
+
+class NegativeEntry:
+    """A short-lived cached exception or negative result of a decorated
+    function. See `cache_exceptions` and `negative_results` of `Cache`."""
+
+    __slots__ = ('expires', 'value', 'exception')
+
+    def __init__(self, expires, value=None, exception=None):
+        self.expires = expires
+        self.value = value
+        self.exception = exception
+
+    def __reduce__(self):
+        return self.__class__, (self.expires, self.value, self.exception)
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(expires={self.expires!r}, '
+            f'value={self.value!r}, exception={self.exception!r})'
+        )
+
+
 class Cache:
     """Cache.
 
     Can be used as a function decorator and as a dict-like key-value store.
     """
+    # The format of the keys and values produced by `encode`. Recorded in
+    # the storage, so a cache file written in another format is emptied
+    # instead of being decoded.
+    serializer = 'pickle'
+    # Maximum amount of time in seconds the stats collected with `stats=True`
+    # are kept in memory before they are saved to the storage.
+    stats_save_interval = 60
 
     def __init__(
         self,
@@ -45,6 +102,16 @@ class Cache:
         policy: str='FIFO',
         key: Callable=make_key,
         only_on_errors=False,
+        write_behind: bool=False,
+        flush_count: int=100,
+        flush_interval: Union[float, int]=1.0,
+        tag: Union[str, None]=None,
+        cache_exceptions: Union[type, Tuple[type, ...]]=(),
+        negative_results: tuple=(),
+        negative_ttl: Union[float, int]=60,
+        storage: Union[CacheStorageBase, None]=None,
+        refresher: Union[Refresher, None]=None,
+        stats: bool=False,
         **kwargs
     ):
         """
@@ -64,6 +131,42 @@ class Cache:
             only_on_errors: exception or a tuple of exceptions. Return cached
                 results only in case of the exceptions are raisd in the
                 decorated function.
+            write_behind: if True then items are not written to the storage
+                immediately but queued in memory and written in batches.
+                See `SQLiteStorage` for details.
+            flush_count: maximum number of items queued in write-behind mode.
+            flush_interval: amount of time in seconds after which the items
+                queued in write-behind mode are flushed on the next access
+                to the cache. See `SQLiteStorage`.
+            tag: the tag under which the results of the decorated functions
+                are stored. Defaults to the full name of the function.
+                See `invalidate`.
+            cache_exceptions: exception or a tuple of exceptions. If
+                the decorated function raises one of them then the exception
+                is cached for `negative_ttl` seconds and is raised again
+                on the calls with the same arguments.
+            negative_results: the results of the decorated function which
+                are cached only for `negative_ttl` seconds, e.g. `(None,)`.
+                The results are compared by identity.
+            negative_ttl: amount of time in seconds the exceptions and
+                the negative results are cached. Should be less than `ttl`.
+            storage: a `CacheStorageBase` instance to use instead of
+                a `SQLiteStorage`, e.g. `caching.memory.MemoryStorage` or
+                `caching.remote.RemoteStorage`.
+                If given, then `maxsize`, `ttl`, `filepath`, `policy` and
+                the write-behind parameters are ignored. The storage is
+                shared with the copies of the cache. Such a cache can not
+                be pickled.
+            refresher: a `caching.refresh.Refresher` instance refreshing
+                the frequently hit results of the decorated functions before
+                they expire. Used only if the `ttl` of the storage is positive.
+                Such a cache can not be pickled.
+            stats: if True then the hits, the misses, the time spent in
+                the decorated functions and the size of their results are
+                counted per function and saved to the storage on `flush`,
+                on `close` and every `stats_save_interval` seconds.
+                The counters start from zero in a forked child process.
+                See `get_stats`.
         """
         self.params = OrderedDict(
             maxsize=maxsize,
@@ -72,16 +175,57 @@ class Cache:
             policy=policy,
             key=key,
             only_on_errors=only_on_errors,
+            write_behind=write_behind,
+            flush_count=flush_count,
+            flush_interval=flush_interval,
+            tag=tag,
+            cache_exceptions=cache_exceptions,
+            negative_results=negative_results,
+            negative_ttl=negative_ttl,
+            storage=storage,
+            refresher=refresher,
+            stats=stats,
             **kwargs,
         )
         self.only_on_errors = only_on_errors
         self.make_key = key
-        self.storage = SQLiteStorage(
-            filepath=filepath or ':memory:',
-            ttl=ttl,
-            maxsize=maxsize,
-            policy=policy,
-        )
+        self.tag = tag
+        self.cache_exceptions = cache_exceptions
+        self.negative_results = negative_results
+        self.negative_ttl = negative_ttl
+        self.refresher = refresher
+        self.stats = stats
+        # The stats collected since they were last saved
+        self.function_stats = {}
+        self.stats_saved = time.monotonic()
+        if stats:
+            _stats_caches.add(self)
+        if storage is None:
+            storage = SQLiteStorage(
+                filepath=filepath or ':memory:',
+                ttl=ttl,
+                maxsize=maxsize,
+                policy=policy,
+                write_behind=write_behind,
+                flush_count=flush_count,
+                flush_interval=flush_interval,
+                serializer=self.serializer,
+            )
+        self.storage = storage
+
+    def __reduce__(self):
+        # Pickled caches are restored with the same parameters, so
+        # a file-based cache re-attaches to the same file, e.g. in
+        # the worker processes of a `ProcessPoolExecutor`. In-memory caches
+        # are restored empty. Storage and refresher objects hold connections,
+        # threads or the cached items themselves, so they are not copied.
+        for param in ('storage', 'refresher'):
+            if self.params[param] is not None:
+                raise TypeError(
+                    f'Can not pickle a {self.__class__.__name__} created '
+                    f'with {param}=: create the cache in each process instead'
+                )
+        return _restore_cache, (self.__class__, dict(self.params))
 
     def __repr__(self):
         return (
@@ -89,37 +233,209 @@ class Cache:
             f"({', '.join(f'{k}={repr(v)}' for k,v in self.params.items())})"
         )
 
-    def _decorator(self, fn):
+    def _decorator(self, fn, key_function=None):
         if not callable(fn):
             raise TypeError(f'{fn} is not callable')
 
+        # The attributes of the cache are bound once here, the storage
+        # of a decorated function does not change.
         key_prefix = _function_name(fn)
-        make_key_ = self.make_key
-
-        @wraps(fn)
-        def wrapper(*args, **kwargs):
-            global MISS
-            nonlocal self, key_prefix, make_key_, fn
-            key = (key_prefix, *make_key_(*args, **kwargs))
-            # Something unique is needed here.
-            # None is not an option because fn may return None. So MISS is used
-            if self.only_on_errors:
+        make_key_ = key_function or self.make_key
+        tag = self.tag or key_prefix
+        storage = self.storage
+        # The default encoding is called directly, saving a method call
+        # per key and per value
+        if type(self).encode is Cache.encode:
+            encode = pickle.dumps
+        else:
+            encode = self.encode
+        if type(self).decode is Cache.decode:
+            decode = pickle.loads
+        else:
+            decode = self.decode
+        only_on_errors = self.only_on_errors
+        cache_exceptions = self.cache_exceptions
+        negative_results = self.negative_results
+        refresher = self.refresher if storage.ttl > 0 else None
+        if self.stats:
+            fstats = self.function_stats.setdefault(key_prefix, FunctionStats())
+        else:
+            fstats = None
+
+        def save_stats_if_due():
+            if time.monotonic() - self.stats_saved > self.stats_save_interval:
+                self.save_stats()
+
+        if negative_results:
+            def encode_refreshed(res):
+                # The refresher stores the results for the full ttl, so
+                # a negative result is not stored by a refresh. It is stored
+                # for negative_ttl by the call after the item expires.
+                if any(res is v for v in negative_results):
+                    return None
+                return encode(res)
+        else:
+            encode_refreshed = encode
+
+        # The keys of the default key function are built in place: the calls
+        # without keyword arguments are keyed by the positional arguments
+        # as is, see `make_key`
+        positional_key = make_key_ is make_key
+        if positional_key:
+            def build_key(args, kwargs):
+                return (
+                    key_prefix, args,
+                    *chain.from_iterable(sorted(kwargs.items())),
+                )
+        else:
+            def build_key(args, kwargs):
+                return (key_prefix, *make_key_(*args, **kwargs))
+
+        # Key functions keying on the identity of the arguments (see
+        # `caching.keys.IdentityKey`) tell which arguments the cached result
+        # must not outlive. The keys of the collected arguments are deleted
+        # on the next call, before an id can be looked up again.
+        referents = getattr(make_key_, 'referents', None)
+        dead_keys = []
+
+        def forget_dead_keys():
+            while dead_keys:
+                with suppress(KeyError):
+                    del storage[dead_keys.pop()]
+
+        def remember(encoded_key, args, kwargs):
+            for obj in referents(args, kwargs):
+                weakref.finalize(obj, dead_keys.append, encoded_key)
+
+        if only_on_errors:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if dead_keys:
+                    forget_dead_keys()
+                if positional_key and not kwargs:
+                    encoded_key = encode((key_prefix, *args))
+                else:
+                    encoded_key = encode(build_key(args, kwargs))
+                if fstats is not None:
+                    started = time.perf_counter()
                 try:
                     res = fn(*args, **kwargs)
-                except self.only_on_errors as e:
-                    res = self.get(key, MISS)
-                    if res is MISS:
+                except only_on_errors as e:
+                    # Something unique is needed here. None is not an option
+                    # because fn may return None. So MISS is used
+                    data = storage.get(encoded_key, MISS)
+                    if data is MISS:
                         raise e
+                    if fstats is not None:
+                        fstats.hits += 1
+                        save_stats_if_due()
+                    return decode(data)
+                data = encode(res)
+                storage.set(encoded_key, data, tag=tag)
+                if fstats is not None:
+                    fstats.misses += 1
+                    fstats.compute_time += time.perf_counter() - started
+                    fstats.value_bytes += len(data)
+                    save_stats_if_due()
+                if referents:
+                    remember(encoded_key, args, kwargs)
+                return res
+        else:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if dead_keys:
+                    forget_dead_keys()
+                if refresher is not None:
+                    refresher.tick()
+                if positional_key and not kwargs:
+                    key = (key_prefix, *args)
+                else:
+                    key = build_key(args, kwargs)
+                encoded_key = encode(key)
+                data = storage.get(encoded_key, MISS)
+                if data is not MISS:
+                    try:
+                        res = decode(data)
+                    except Exception:
+                        # E.g. an item written by another version of the code,
+                        # it is a miss and is replaced by the new result
+                        pass
+                    else:
+                        if type(res) is not NegativeEntry:
+                            if refresher is not None:
+                                refresher.hit(encoded_key)
+                            if fstats is not None:
+                                fstats.hits += 1
+                                save_stats_if_due()
+                            return res
+                        if res.expires > time.time():
+                            if fstats is not None:
+                                fstats.hits += 1
+                                save_stats_if_due()
+                            if res.exception is not None:
+                                raise res.exception
+                            return res.value
+                if fstats is not None:
+                    started = time.perf_counter()
+                try:
+                    res = fn(*args, **kwargs)
+                except cache_exceptions as e:
+                    self._set_negative(key, tag, exception=e)
+                    raise
+                if fstats is not None:
+                    fstats.misses += 1
+                    fstats.compute_time += time.perf_counter() - started
+                if negative_results and any(
+                    res is v for v in negative_results
+                ):
+                    self._set_negative(key, tag, value=res)
                 else:
-                    self[key] = res
-            else:
-                res = self.get(key, MISS)
-                if res is MISS:
-                    res = self[key] = fn(*args, **kwargs)
-            return res
+                    data = encode(res)
+                    storage.set(encoded_key, data, tag=tag)
+                    if fstats is not None:
+                        fstats.value_bytes += len(data)
+                    if refresher is not None:
+                        refresher.track(
+                            encoded_key, storage, encode_refreshed, fn,
+                            args, kwargs, tag, storage.ttl,
+                        )
+                if fstats is not None:
+                    save_stats_if_due()
+                if referents:
+                    remember(encoded_key, args, kwargs)
+                return res
+
         wrapper._cache = self
         return wrapper
 
+    def method(self, fn=None, *, per_instance=False, attribute=None):
+        """Method decorator. See `CachedMethod`.
+
+        Unlike decorating a method with the `Cache` instance itself,
+        the instance is not pickled into the keys.
+        """
+        if fn is None:
+            return partial(
+                self.method, per_instance=per_instance, attribute=attribute,
+            )
+        return CachedMethod(
+            self, fn, per_instance=per_instance, attribute=attribute,
+        )
+
+    def _set_negative(self, key, tag, value=None, exception=None):
+        entry = NegativeEntry(
+            time.time() + self.negative_ttl, value, exception,
+        )
+        try:
+            value = self.encode(entry)
+            # Many exceptions can be pickled but not unpickled, e.g. when
+            # their __init__ takes other arguments than their args
+            self.decode(value)
+        except Exception:
+            # E.g. an exception which can not be pickled. Not caching it.
+            return
+        self.storage.set(self.encode(key), value, tag=tag)
+
     def __call__(self, fn=None, **kwargs):
         if fn is None and kwargs:
             return self.copy(**kwargs)(fn)
@@ -134,6 +450,19 @@ class Cache:
     def __setitem__(self, key, value):
         self.storage[self.encode(key)] = self.encode(value)
 
+    def set(self, key, value, tag: Union[str, None]=None):
+        """Store the `value` under the `key`. The `tag` can be used to
+        invalidate the item along with other items having the same tag."""
+        self.storage.set(self.encode(key), self.encode(value), tag=tag)
+
+    def invalidate(self, *tags: Union[str, Callable]):
+        """Invalidate all the items stored with any of the `tags`.
+
+        Functions can be passed instead of tags to invalidate the results
+        of the functions decorated without an explicit `tag`.
+        """
+        self.storage.invalidate(*map(_tag_name, tags))
+
     def __delitem__(self, key):
         del self.storage[self.encode(key)]
 
@@ -141,12 +470,37 @@ class Cache:
         global MISS
         return self.get(key, MISS) is not MISS
 
-    def items(self):
+    def __len__(self):
+        return len(self.storage)
+
+    def items(self, *, tag=None, max_age=None, batch_size=1000):
+        """Iterate over the items in the order they were stored.
+
+        Args:
+            tag: only the items stored with the tag. A function can be passed
+                to get only its results.
+            max_age: only the items stored not more than `max_age` seconds ago.
+            batch_size: number of items fetched from the storage at a time.
+        """
         return (
             (self.decode(k), self.decode(v))
-            for k, v in self.storage.items()
+            for k, v in self.storage.items(
+                tag=_tag_name(tag), max_age=max_age, batch_size=batch_size,
+            )
         )
 
+    def keys(self, *, tag=None, max_age=None, batch_size=1000):
+        """Same as `items` but the values are not fetched nor decoded."""
+        return map(self.decode, self.storage.keys(
+            tag=_tag_name(tag), max_age=max_age, batch_size=batch_size,
+        ))
+
+    def values(self, *, tag=None, max_age=None, batch_size=1000):
+        """Same as `items` but the keys are not decoded."""
+        return map(self.decode, self.storage.values(
+            tag=_tag_name(tag), max_age=max_age, batch_size=batch_size,
+        ))
+
     def get(self, key, default=None):
         res = self.storage.get(self.encode(key), default)
         if res is not default:
@@ -156,7 +510,72 @@ class Cache:
     def clear(self):
         self.storage.clear()
 
+    def memory_usage(self) -> int:
+        """Number of bytes taken by the items in the storage. See
+        `memory_usage` of the storage."""
+        return self.storage.memory_usage()
+
+    def flush(self):
+        if self.stats:
+            self.save_stats()
+        self.storage.flush()
+
+    def save_stats(self):
+        """Add the stats collected since the last save to the stats saved
+        in the storage. If the storage can not save stats then they are kept
+        in memory."""
+        self.stats_saved = time.monotonic()
+        stats = {
+            name: s.take()
+            for name, s in self.function_stats.items() if s.hits or s.misses
+        }
+        if not stats:
+            return
+        try:
+            self.storage.save_stats(stats)
+        except NotImplementedError:
+            for name, values in stats.items():
+                self.function_stats[name].add(*values)
+
+    def get_stats(self) -> Dict[str, FunctionStats]:
+        """The stats of the decorated functions by function name: the saved
+        ones plus the ones not yet saved. See `stats` and
+        `caching.stats.format_report`."""
+        try:
+            saved = self.storage.load_stats()
+        except NotImplementedError:
+            saved = {}
+        stats = {name: FunctionStats(*values) for name, values in saved.items()}
+        for name, s in self.function_stats.items():
+            stats.setdefault(name, FunctionStats()).add(*s.values())
+        return stats
+
+    def dump(self, filepath: str):
+        """Save a snapshot of the cache to `filepath`."""
+        self.storage.dump(filepath)
+
+    def load(self, filepath: str):
+        """Load the items from a snapshot saved by `dump`.
+
+        Timestamps and policy counters of the items are preserved so
+        the loaded items expire and get evicted as they would in the original
+        cache.
+        """
+        self.storage.load(filepath)
+
+    def refresh(self):
+        """Store the results refreshed by the `refresher` and start
+        the refreshes which are due. Called on each call of the decorated
+        functions, call it explicitly if they are not called often."""
+        if self.refresher is not None:
+            self.refresher.tick()
+
     def close(self):
+        if self.refresher is not None:
+            self.refresher.close()
+        if self.stats:
+            self.save_stats()
+            _stats_caches.discard(self)
         self.storage.close()
 
     def copy(self, **kwargs):
@@ -172,7 +591,82 @@ class Cache:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.storage.close()
+        self.close()
 
     def remove(self):
         self.storage.remove()
+
+
+def _restore_cache(cls, params):
+    return cls(**params)
+
+
+class CachedMethod:
+    """Descriptor caching the results of a method.
+
+    By default the results are stored in the storage of the cache. The instance
+    is identified by the result of its `__cache_key__()` method if it has one,
+    or by its `id` otherwise, in which case the results are deleted when
+    the instance is garbage collected. See `caching.keys.MethodKey`.
+
+    If `per_instance` is True then the results are stored in a dict in
+    the `attribute` of the instance (`_<method name>_cache` by default)
+    and are neither pickled nor shared between instances. The results are
+    freed with the instance. Classes with `__slots__` must have the attribute
+    in their slots. `maxsize` and `ttl` of the cache are applied per instance,
+    the oldest results are evicted first.
+    """
+
+    def __init__(self, cache, fn, *, per_instance=False, attribute=None):
+        if not callable(fn):
+            raise TypeError(f'{fn} is not callable')
+        update_wrapper(self, fn)
+        self.cache = cache
+        self.per_instance = per_instance
+        self.attribute = attribute or f'_{fn.__name__}_cache'
+        if per_instance:
+            self.function = wraps(fn)(partial(self._call_per_instance, fn))
+        else:
+            self.function = cache._decorator(
+                fn, key_function=MethodKey(cache.make_key),
+            )
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return MethodType(self.function, instance)
+
+    def _call_per_instance(self, fn, instance, *args, **kwargs):
+        try:
+            results = getattr(instance, self.attribute)
+        except AttributeError:
+            results = {}
+            try:
+                setattr(instance, self.attribute, results)
+            except AttributeError:
+                raise TypeError(
+                    f'Can not store cached results in {self.attribute} '
+                    f'attribute of {type(instance).__qualname__} object. '
+                    f'Add {self.attribute!r} to __slots__.'
+                ) from None
+
+        key = self.cache.make_key(*args, **kwargs)
+        try:
+            hash(key)
+        except TypeError:
+            key = self.cache.encode(key)
+
+        ttl = self.cache.params['ttl']
+        item = results.get(key)
+        if item is not None:
+            ts, res = item
+            if ttl <= 0 or time.monotonic() - ts <= ttl:
+                return res
+            del results[key]
+
+        res = fn(instance, *args, **kwargs)
+        results[key] = (time.monotonic(), res)
+        maxsize = self.cache.params['maxsize']
+        if 0 < maxsize < len(results):
+            del results[next(iter(results))]
+        return res
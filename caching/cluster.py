@@ -0,0 +1,234 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Sequence, Union
+
+from .storage import CacheStorageBase
+
+
+class ClusterStorage(CacheStorageBase):
+    """Storage spreading the keys over several storages (nodes), e.g.
+    `RemoteStorage` instances connected to different cache servers.
+
+    Each key is stored on one node chosen by rendezvous (highest random
+    weight) hashing of the key and the names of the nodes. When a node is
+    added or removed only the keys of that node move.
+
+    The operations involving many nodes (`get_many`, `set_many`, `clear`,
+    `invalidate`, etc.) are run on the nodes in parallel in a thread pool,
+    so the nodes must be thread-safe unless `max_workers` is 0.
+
+    A node raising one of `errors` is considered down for `retry_interval`
+    seconds: reading from it returns misses, writing to it does nothing.
+    """
+
+    def __init__(
+        self,
+        nodes: Union[Sequence[CacheStorageBase], Dict[str, CacheStorageBase]],
+        *,
+        max_workers: Union[int, None]=None,
+        errors: tuple=(OSError,),
+        retry_interval: Union[int, float]=5,
+        maxsize: int=-1,
+        ttl: Union[int, float]=-1,
+        policy: str='FIFO',
+    ):
+        """
+        Args:
+            nodes: the storages, or a dict of the storages by node names.
+                The names determine which keys are stored on a node, so they
+                must stay the same when the nodes are changed. By default
+                the name is the `repr` of the storage, e.g. the address of
+                a `RemoteStorage`.
+            max_workers: maximum number of the threads used for the operations
+                on many nodes. Defaults to the number of the nodes. If 0 then
+                the nodes are called one after another.
+            errors: the exceptions which mean that a node is down.
+            retry_interval: amount of time in seconds a node which is down
+                is not called.
+        """
+        super(ClusterStorage, self).__init__(
+            maxsize=maxsize, ttl=ttl, policy=policy,
+        )
+        if not isinstance(nodes, dict):
+            nodes = {repr(node): node for node in nodes}
+        if not nodes:
+            raise ValueError('No nodes')
+        self.nodes = nodes
+        self.seeds = [
+            (hashlib.blake2b(name.encode(), digest_size=16).digest(), name)
+            for name in nodes
+        ]
+        self.max_workers = len(nodes) if max_workers is None else max_workers
+        self.errors = errors
+        self.retry_interval = retry_interval
+        self.down_until = {}
+        self.executor = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({list(self.nodes)!r})'
+
+    def node_name(self, key):
+        """Name of the node storing the key."""
+        return max(
+            self.seeds,
+            key=lambda seed_name: hashlib.blake2b(
+                key, key=seed_name[0], digest_size=8,
+            ).digest(),
+        )[1]
+
+    def call(self, name, method, *args, default=None, **kwargs):
+        """Call the method of the node. Returns the `default` if the node is
+        down."""
+        down_until = self.down_until.get(name)
+        if down_until is not None:
+            if time.monotonic() < down_until:
+                return default
+            del self.down_until[name]
+        try:
+            return getattr(self.nodes[name], method)(*args, **kwargs)
+        except self.errors:
+            self.mark_down(name)
+            return default
+
+    def mark_down(self, name):
+        self.down_until[name] = time.monotonic() + self.retry_interval
+
+    def iterate(self, name, method, **kwargs):
+        """Iterate over the iterator returned by the method of the node,
+        e.g. `items`. Stops when the node is down, the iterators of remote
+        nodes connect lazily and may fail at any item."""
+        iterator = iter(self.call(name, method, default=(), **kwargs))
+        while True:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except self.errors:
+                self.mark_down(name)
+                return
+            yield item
+
+    def call_many(self, calls, default=None):
+        """Run the calls, each a tuple of a node name, a method name and
+        the arguments, in parallel. Returns the list of the results."""
+        calls = list(calls)
+        if self.max_workers == 0 or len(calls) < 2:
+            return [
+                self.call(name, method, *args, default=default)
+                for name, method, *args in calls
+            ]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_workers)
+        futures = [
+            self.executor.submit(
+                self.call, name, method, *args, default=default,
+            )
+            for name, method, *args in calls
+        ]
+        return [f.result() for f in futures]
+
+    def call_all(self, method, *args, default=None):
+        return self.call_many(
+            ((name, method, *args) for name in self.nodes), default=default,
+        )
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, tag=None):
+        self.call(self.node_name(key), 'set', key, value, tag=tag)
+
+    def __getitem__(self, key):
+        res = self.get(key, None)
+        if res is None:
+            raise KeyError('Not found')
+        return res
+
+    def get(self, key, default=None):
+        return self.call(
+            self.node_name(key), 'get', key, default, default=default,
+        )
+
+    def __delitem__(self, key):
+        deleted = self.call(
+            self.node_name(key), '__delitem__', key, default=False,
+        )
+        if deleted is False:
+            raise KeyError('Not found')
+
+    def group_by_node(self, keys):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.node_name(key), []).append(i)
+        return groups
+
+    def get_many(self, keys, default=None):
+        keys = list(keys)
+        groups = self.group_by_node(keys)
+        results = self.call_many(
+            (
+                (name, 'get_many', [keys[i] for i in indexes], default)
+                for name, indexes in groups.items()
+            ),
+            default=(),
+        )
+        values = [default] * len(keys)
+        for indexes, node_values in zip(groups.values(), results):
+            for i, value in zip(indexes, node_values):
+                values[i] = value
+        return values
+
+    def set_many(self, items, tag=None):
+        items = list(items)
+        groups = self.group_by_node([key for key, value in items])
+        self.call_many(
+            (name, 'set_many', [items[i] for i in indexes], tag)
+            for name, indexes in groups.items()
+        )
+
+    def invalidate(self, *tags):
+        self.call_all('invalidate', *tags)
+
+    def clear(self):
+        self.call_all('clear')
+
+    def flush(self):
+        self.call_all('flush')
+
+    def __len__(self):
+        """Total number of the items on the nodes which are up."""
+        return sum(self.call_all('__len__', default=0))
+
+    def items(self, *, tag=None, max_age=None, batch_size=1000):
+        """Items of all the nodes which are up, node by node."""
+        return chain.from_iterable(
+            self.iterate(
+                name, 'items', tag=tag, max_age=max_age,
+                batch_size=batch_size,
+            )
+            for name in self.nodes
+        )
+
+    def keys(self, *, tag=None, max_age=None, batch_size=1000):
+        """Same as `items` but the values are not fetched."""
+        return chain.from_iterable(
+            self.iterate(
+                name, 'keys', tag=tag, max_age=max_age,
+                batch_size=batch_size,
+            )
+            for name in self.nodes
+        )
+
+    def values(self, *, tag=None, max_age=None, batch_size=1000):
+        return (value for key, value in self.items(
+            tag=tag, max_age=max_age, batch_size=batch_size,
+        ))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for node in self.nodes.values():
+            node.close()
@@ -0,0 +1,156 @@
+"""Key functions for the `key` parameter of `Cache`."""
+import hashlib
+import os
+import weakref
+
+# Random token of the process put in the keys made of ids. An id is only
+# unique within a process, while a cache file or a cache server may be
+# shared by many processes, e.g. forked workers, which reuse the same ids.
+_process_token = os.urandom(8)
+
+
+def _new_process_token():
+    global _process_token
+    _process_token = os.urandom(8)
+
+
+if hasattr(os, 'register_at_fork'):  # Python 3.7+
+    os.register_at_fork(after_in_child=_new_process_token)
+
+
+def make_key(*args, **kwargs):
+    if kwargs:
+        return (args, *(x for kv in sorted(kwargs.items()) for x in kv))
+    else:
+        return args
+
+
+def _id_key(obj):
+    return ('__id__', _process_token, id(obj))
+
+
+def _is_weakrefable(obj):
+    try:
+        weakref.ref(obj)
+    except TypeError:
+        return False
+    return True
+
+
+class IdentityKey:
+    """Key function which identifies the arguments supporting weak references
+    (instances of most classes, e.g. NumPy arrays and pandas DataFrames)
+    by their `id` instead of their value, so the arguments are neither
+    compared nor pickled. Other arguments (numbers, strings, tuples, lists,
+    etc.) are used as is.
+
+    When `Cache` sees this key function it deletes the cached result
+    when any of the arguments identified by `id` is garbage collected, so
+    the entries die with their arguments and the ids are never confused
+    after being reused.
+
+    The keys include a random token of the process, so the processes
+    sharing a cache file or a cache server never see each other's results,
+    but the results cached by a process are not reused by other processes
+    either. The results stored by a process which exits are left to be
+    deleted by ttl and maxsize cleanup.
+    """
+
+    def __call__(self, *args, **kwargs):
+        return make_key(
+            *map(self.identify, args),
+            **{k: self.identify(v) for k, v in kwargs.items()},
+        )
+
+    @staticmethod
+    def identify(obj):
+        if _is_weakrefable(obj):
+            return _id_key(obj)
+        return obj
+
+    @staticmethod
+    def referents(args, kwargs):
+        """The arguments the cached result must not outlive."""
+        for obj in (*args, *kwargs.values()):
+            if _is_weakrefable(obj):
+                yield obj
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+
+identity_key = IdentityKey()
+
+
+class MethodKey:
+    """Key function for the methods decorated with `Cache.method`.
+
+    The instance (the first argument) is identified by the result of its
+    `__cache_key__()` method if it has one, or by its `id` otherwise. In
+    the latter case the cached results are deleted when the instance is
+    garbage collected and are private to the process, the same way as with
+    `IdentityKey`. Define `__cache_key__` to share the results between
+    processes. The rest of the arguments are passed to `make_key`.
+    """
+
+    def __init__(self, make_key=make_key):
+        self.make_key = make_key
+        self.make_key_referents = getattr(make_key, 'referents', None)
+
+    def __call__(self, instance, *args, **kwargs):
+        return self.make_key(self.identify(instance), *args, **kwargs)
+
+    @staticmethod
+    def identify(instance):
+        cache_key = getattr(instance, '__cache_key__', None)
+        if cache_key is not None:
+            return ('__cache_key__', cache_key())
+        if not _is_weakrefable(instance):
+            raise TypeError(
+                f'Can not cache methods of {type(instance).__qualname__} '
+                f'objects: define __cache_key__ method or add __weakref__ '
+                f'to __slots__'
+            )
+        return _id_key(instance)
+
+    def referents(self, args, kwargs):
+        instance, *args = args
+        if not hasattr(instance, '__cache_key__'):
+            yield instance
+        if self.make_key_referents:
+            yield from self.make_key_referents(args, kwargs)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.make_key!r})'
+
+
+def fingerprint(obj):
+    """Content fingerprint of the objects supporting the buffer protocol
+    (bytes, bytearray, array.array, NumPy arrays, etc.).
+
+    The buffer is hashed in place, without copying, if it is C-contiguous.
+    Other objects are returned as is.
+    """
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        return obj
+    with view:
+        data = view if view.c_contiguous else view.tobytes()
+        return (
+            '__fingerprint__',
+            f'{type(obj).__module__}.{type(obj).__qualname__}',
+            view.format,
+            view.shape,
+            hashlib.blake2b(data, digest_size=20).digest(),
+        )
+
+
+def fingerprint_key(*args, **kwargs):
+    """Key function which uses the content fingerprints of the arguments
+    supporting the buffer protocol instead of the arguments themselves,
+    so the large arrays are hashed instead of being pickled into the key."""
+    return make_key(
+        *map(fingerprint, args),
+        **{k: fingerprint(v) for k, v in kwargs.items()},
+    )
@@ -0,0 +1,82 @@
+"""Binary protocol of the cache server.
+
+A message (a request or a response) is a header followed by fields::
+
+    header: code (unsigned char), number of fields (unsigned int)
+    field:  length (unsigned int), data (`length` bytes)
+
+All numbers are in network byte order. A field with length `NONE` has no
+data and stands for `None`. The code of a request is an operation (`GET`,
+`SET`, ...), the code of a response is a status (`OK`, `MISS`, `ERROR`).
+"""
+import struct
+
+HEADER = struct.Struct('!BI')
+FIELD = struct.Struct('!I')
+NONE = 0xFFFFFFFF
+
+# Operations
+GET = 1  # key -> value or None
+SET = 2  # key, value, tag -> nothing
+DELETE = 3  # key -> nothing or MISS status
+GET_MANY = 4  # key, ... -> value or None, ...
+SET_MANY = 5  # tag, key, value, key, value, ... -> nothing
+INVALIDATE = 6  # tag, ... -> nothing
+CLEAR = 7  # nothing -> nothing
+LEN = 8  # nothing -> number
+# Pages of the items ordered by ts and key, starting after the last ts and
+# key of the previous page, or from the start if they are None.
+ITEMS = 9  # tag, max_age, ts, key, limit -> ts, key, value, ts, key, value, ...
+KEYS = 10  # tag, max_age, ts, key, limit -> ts, key, ts, key, ...
+FLUSH = 11  # nothing -> nothing
+
+# Statuses
+OK = 0
+MISS = 1
+ERROR = 2
+
+
+def pack(code, fields=()):
+    parts = [HEADER.pack(code, len(fields))]
+    for field in fields:
+        if field is None:
+            parts.append(FIELD.pack(NONE))
+        else:
+            parts.append(FIELD.pack(len(field)))
+            parts.append(field)
+    return b''.join(parts)
+
+
+def encode_str(s):
+    return None if s is None else str(s).encode()
+
+
+def decode_str(data):
+    return None if data is None else data.decode()
+
+
+def decode_float(data):
+    return None if data is None else float(data)
+
+
+def read(read_exactly):
+    """Read a message using `read_exactly(n)` function which returns exactly
+    `n` bytes. Returns a tuple of the code and the list of the fields."""
+    code, n = HEADER.unpack(read_exactly(HEADER.size))
+    fields = []
+    for _ in range(n):
+        length, = FIELD.unpack(read_exactly(FIELD.size))
+        fields.append(None if length == NONE else read_exactly(length))
+    return code, fields
+
+
+async def read_async(reader):
+    """Same as `read` for an `asyncio.StreamReader`."""
+    code, n = HEADER.unpack(await reader.readexactly(HEADER.size))
+    fields = []
+    for _ in range(n):
+        length, = FIELD.unpack(await reader.readexactly(FIELD.size))
+        fields.append(
+            None if length == NONE else await reader.readexactly(length)
+        )
+    return code, fields
@@ -0,0 +1,192 @@
+import heapq
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import suppress
+from typing import Union
+
+
+class _Entry:
+    __slots__ = (
+        'storage', 'encode', 'fn', 'args', 'kwargs', 'tag', 'ttl',
+        'stored_at', 'due', 'hits', 'refreshing',
+    )
+
+    def __init__(self, storage, encode, fn, args, kwargs, tag, ttl):
+        self.storage = storage
+        self.encode = encode
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.tag = tag
+        self.ttl = ttl
+        self.stored_at = None
+        self.due = None
+        self.hits = 0
+        self.refreshing = False
+
+
+class Refresher:
+    """Refreshes the hot results of the decorated functions before they
+    expire, so the callers do not hit the expiry.
+
+    Pass an instance as `refresher` to `Cache` with a positive `ttl`. The
+    decorator then remembers the arguments of the calls and counts the hits
+    of the cached results. `refresh_ahead` seconds before a result expires,
+    if it was hit at least `min_hits` times since it was stored, the function
+    is called again with the same arguments in a thread pool and the new
+    result is stored. Results which are not hot are forgotten, as are
+    the calls which raise an exception or return one of `negative_results`
+    of the cache when refreshed.
+
+    The work is scheduled and the new results are stored by the calls of
+    the decorated functions (see `tick`), so the storage is only used from
+    the threads calling the functions. The functions themselves are called
+    in the pool threads and must be thread-safe.
+
+    The arguments of up to `max_keys` results are kept in memory.
+    """
+
+    def __init__(
+        self,
+        *,
+        refresh_ahead: Union[int, float]=10,
+        min_hits: int=2,
+        max_workers: int=2,
+        max_pending: int=16,
+        budget: Union[int, None]=None,
+        budget_interval: Union[int, float]=60,
+        max_keys: int=1024,
+    ):
+        """
+        Args:
+            refresh_ahead: amount of time in seconds before the expiry
+                of a result when it is refreshed.
+            min_hits: minimum number of hits of a result since it was stored
+                for the result to be refreshed.
+            max_workers: number of the threads calling the functions.
+            max_pending: maximum number of the refreshes scheduled or running
+                at the same time.
+            budget: maximum number of the refreshes per `budget_interval`
+                seconds. Not limited if None.
+            budget_interval: see `budget`.
+            max_keys: maximum number of the results tracked.
+        """
+        self.refresh_ahead = refresh_ahead
+        self.min_hits = min_hits
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.budget = budget
+        self.budget_interval = budget_interval
+        self.max_keys = max_keys
+        self.entries = {}
+        self.schedule = []  # heap of (due, key)
+        self.done = deque()
+        self.pending = set()
+        self.started = deque()  # start times of the refreshes within budget
+        self.executor = None
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(refresh_ahead={self.refresh_ahead!r}, '
+            f'min_hits={self.min_hits!r}, max_workers={self.max_workers!r})'
+        )
+
+    def track(self, key, storage, encode, fn, args, kwargs, tag, ttl):
+        """Remember the call which result was just stored under the `key`.
+        If `encode` returns None for a refreshed result, the result is not
+        stored and the call is forgotten."""
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.max_keys:
+                return
+            entry = self.entries[key] = _Entry(
+                storage, encode, fn, args, kwargs, tag, ttl,
+            )
+        self._stored(key, entry, time.monotonic())
+
+    def hit(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.hits += 1
+
+    def tick(self):
+        """Store the refreshed results and start the refreshes which
+        are due."""
+        now = None
+        while self.done:
+            key, data = self.done.popleft()
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            entry.refreshing = False
+            if data is None:  # An exception or a result not to be stored
+                del self.entries[key]
+                continue
+            entry.storage.set(key, data, tag=entry.tag)
+            now = now or time.monotonic()
+            self._stored(key, entry, now)
+
+        schedule = self.schedule
+        if not schedule:
+            return
+        now = now or time.monotonic()
+        while schedule and schedule[0][0] <= now:
+            due, key = heapq.heappop(schedule)
+            entry = self.entries.get(key)
+            if entry is None or entry.due != due or entry.refreshing:
+                continue
+            if entry.hits < self.min_hits or now >= entry.stored_at + entry.ttl:
+                del self.entries[key]
+                continue
+            if len(self.pending) >= self.max_pending or not self._in_budget(now):
+                # Trying again a bit later, while the result is still valid
+                entry.due = now + min(1, self.refresh_ahead / 4)
+                heapq.heappush(schedule, (entry.due, key))
+                break
+            self._submit(key, entry, now)
+
+    def _stored(self, key, entry, now):
+        entry.stored_at = now
+        entry.hits = 0
+        entry.due = now + max(0, entry.ttl - self.refresh_ahead)
+        heapq.heappush(self.schedule, (entry.due, key))
+
+    def _in_budget(self, now):
+        if self.budget is None:
+            return True
+        started = self.started
+        while started and started[0] <= now - self.budget_interval:
+            started.popleft()
+        return len(started) < self.budget
+
+    def _submit(self, key, entry, now):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix='caching-refresher',
+            )
+        entry.refreshing = True
+        self.started.append(now)
+        future = self.executor.submit(self._refresh, key, entry)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+
+    def _refresh(self, key, entry):
+        data = None
+        with suppress(Exception):
+            data = entry.encode(entry.fn(*entry.args, **entry.kwargs))
+        self.done.append((key, data))
+
+    def wait(self, timeout=None):
+        """Wait for the running refreshes to finish."""
+        wait(list(self.pending), timeout=timeout)
+
+    def close(self):
+        """Forget all the results and stop the threads. The running
+        refreshes are not waited for."""
+        self.entries.clear()
+        self.schedule.clear()
+        self.done.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -0,0 +1,244 @@
+import os
+import queue
+import socket
+import weakref
+from contextlib import contextmanager
+from typing import Tuple, Union
+
+from . import protocol
+from .storage import CacheStorageBase
+
+_remote_storages = weakref.WeakSet()
+
+
+def _drop_connections_after_fork():
+    for storage in list(_remote_storages):
+        storage.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):  # Python 3.7+
+    os.register_at_fork(after_in_child=_drop_connections_after_fork)
+
+
+class RemoteStorage(CacheStorageBase):
+    """Client storage for `caching.server.CacheServer`.
+
+    Thread-safe. Keeps a pool of up to `pool_size` idle connections to
+    the server, the pool is emptied in a child process after `os.fork()`. `get_many` and `set_many` send the keys in batches of
+    `batch_size` and pipeline the batches: all the requests are sent before
+    the responses are read.
+
+    `maxsize`, `ttl` and `policy` are the parameters of the storage served
+    by the server, they are ignored here.
+    """
+
+    def __init__(
+        self,
+        address: Union[Tuple[str, int], str],
+        *,
+        pool_size: int=4,
+        timeout: Union[float, None]=None,
+        batch_size: int=100,
+        maxsize: int=-1,
+        ttl: Union[int, float]=-1,
+        policy: str='FIFO',
+    ):
+        """
+        Args:
+            address: (host, port) tuple of a TCP server or a Unix socket path.
+            pool_size: maximum number of the idle connections kept open.
+            timeout: socket timeout in seconds.
+            batch_size: maximum number of the keys in a request of `get_many`
+                or `set_many`.
+        """
+        super(RemoteStorage, self).__init__(
+            maxsize=maxsize, ttl=ttl, policy=policy,
+        )
+        self.address = address
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.pool = queue.LifoQueue()
+        _remote_storages.add(self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.address!r})'
+
+    def connect(self):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except BaseException:
+            sock.close()
+            raise
+        rfile = sock.makefile('rb')
+
+        def read_exactly(n):
+            data = rfile.read(n)
+            if len(data) < n:
+                raise ConnectionError('Connection closed by the cache server')
+            return data
+
+        return sock, rfile, read_exactly
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        except BaseException:
+            # The state of the connection is unknown, e.g. a response
+            # may be left unread.
+            self._close_connection(conn)
+            raise
+        if self.pool.qsize() < self.pool_size:
+            self.pool.put(conn)
+        else:
+            self._close_connection(conn)
+
+    def after_fork(self):
+        """Called in the child process after `os.fork()`.
+
+        The pooled connections are shared with the parent process, so
+        the responses to the requests of both processes would be mixed up.
+        They are closed in the child only and a new pool is created.
+        """
+        pool = self.pool
+        self.pool = queue.LifoQueue()
+        while True:
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                break
+            self._close_connection(conn)
+
+    @staticmethod
+    def _close_connection(conn):
+        sock, rfile, read_exactly = conn
+        rfile.close()
+        sock.close()
+
+    def pipeline(self, requests):
+        """Send the requests, each a tuple of an operation and the fields,
+        then read the responses. Returns the list of the responses, each
+        a tuple of a status and the fields."""
+        with self.connection() as (sock, rfile, read_exactly):
+            sock.sendall(b''.join(
+                protocol.pack(code, fields) for code, fields in requests
+            ))
+            responses = [protocol.read(read_exactly) for _ in requests]
+        for status, fields in responses:
+            if status == protocol.ERROR:
+                raise RuntimeError(
+                    f'Cache server error: {fields[0].decode()}'
+                )
+        return responses
+
+    def request(self, code, fields=()):
+        return self.pipeline([(code, fields)])[0]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, tag=None):
+        self.request(protocol.SET, [key, value, protocol.encode_str(tag)])
+
+    def __getitem__(self, key):
+        res = self.get(key, None)
+        if res is None:
+            raise KeyError('Not found')
+        return res
+
+    def get(self, key, default=None):
+        status, (value,) = self.request(protocol.GET, [key])
+        return default if value is None else value
+
+    def __delitem__(self, key):
+        status, fields = self.request(protocol.DELETE, [key])
+        if status == protocol.MISS:
+            raise KeyError('Not found')
+
+    def get_many(self, keys, default=None):
+        keys = list(keys)
+        responses = self.pipeline([
+            (protocol.GET_MANY, keys[i:i + self.batch_size])
+            for i in range(0, len(keys), self.batch_size)
+        ])
+        return [
+            default if value is None else value
+            for status, values in responses
+            for value in values
+        ]
+
+    def set_many(self, items, tag=None):
+        fields = [x for kv in items for x in kv]
+        step = self.batch_size * 2
+        tag = protocol.encode_str(tag)
+        self.pipeline([
+            (protocol.SET_MANY, [tag, *fields[i:i + step]])
+            for i in range(0, len(fields), step)
+        ])
+
+    def invalidate(self, *tags):
+        self.request(protocol.INVALIDATE, [t.encode() for t in tags])
+
+    def clear(self):
+        self.request(protocol.CLEAR)
+
+    def flush(self):
+        self.request(protocol.FLUSH)
+
+    def __len__(self):
+        status, (n,) = self.request(protocol.LEN)
+        return int(n)
+
+    def pages(self, code, tag, max_age, batch_size):
+        """Request the pages of the items of up to `batch_size` items,
+        yield the fields of each item: (ts, key, value) or (ts, key)."""
+        n = 3 if code == protocol.ITEMS else 2
+        ts = key = None
+        while True:
+            status, fields = self.request(code, [
+                protocol.encode_str(tag), protocol.encode_str(max_age),
+                ts, key, protocol.encode_str(batch_size),
+            ])
+            rows = [fields[i:i + n] for i in range(0, len(fields), n)]
+            yield from rows
+            if len(rows) < batch_size:
+                break
+            ts, key = rows[-1][:2]
+
+    def items(self, *, tag=None, max_age=None, batch_size=1000):
+        """Iterate over the items ordered by the time they were stored,
+        fetching `batch_size` items per request."""
+        for ts, key, value in self.pages(
+            protocol.ITEMS, tag, max_age, batch_size,
+        ):
+            yield key, value
+
+    def keys(self, *, tag=None, max_age=None, batch_size=1000):
+        for ts, key in self.pages(protocol.KEYS, tag, max_age, batch_size):
+            yield key
+
+    def values(self, *, tag=None, max_age=None, batch_size=1000):
+        for ts, key, value in self.pages(
+            protocol.ITEMS, tag, max_age, batch_size,
+        ):
+            yield value
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                break
+            self._close_connection(conn)
@@ -0,0 +1,248 @@
+"""Cache server sharing a cache storage over TCP or a Unix socket.
+
+Run it with::
+
+    python -m caching.server --port 7777 --filepath /var/cache/mycache
+
+and use `caching.remote.RemoteStorage` as the storage of `Cache`.
+"""
+import argparse
+import asyncio
+import threading
+from contextlib import suppress
+from typing import Tuple, Union
+
+from . import protocol
+from .storage import CacheStorageBase, SQLiteStorage
+
+
+class CacheServer:
+    """Asyncio server exposing a `CacheStorageBase` instance.
+
+    All the storage operations are run in the event loop thread one after
+    another, so the storage needs not be thread-safe. The storage is closed
+    when the server is closed.
+    """
+
+    def __init__(
+        self,
+        storage: CacheStorageBase,
+        *,
+        host: str='127.0.0.1',
+        port: int=0,
+        path: Union[str, None]=None,
+    ):
+        """
+        Args:
+            storage: the storage to serve.
+            host: the host to listen on.
+            port: the port to listen on. If 0 then a free port is chosen,
+                see `address`.
+            path: if given then the server listens on the Unix socket
+                at the path instead of `host` and `port`.
+        """
+        self.storage = storage
+        self.host = host
+        self.port = port
+        self.path = path
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.writers = set()
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.storage!r}, '
+            f'address={self.address!r})'
+        )
+
+    @property
+    def address(self) -> Union[Tuple[str, int], str]:
+        """The address to pass to `RemoteStorage`."""
+        if self.path is not None:
+            return self.path
+        if self.server is not None:
+            return self.server.sockets[0].getsockname()[:2]
+        return self.host, self.port
+
+    async def start(self):
+        if self.path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.handle, path=self.path,
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, host=self.host, port=self.port,
+            )
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def start_in_thread(self):
+        """Start the server in an event loop in a daemon thread.
+
+        Returns once the server is listening.
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self.start())
+            except BaseException as e:
+                errors.append(e)
+                return
+            finally:
+                started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self._shutdown())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def close(self):
+        """Stop the server started by `start_in_thread`."""
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+
+    async def _shutdown(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+        self.storage.close()
+
+    def __enter__(self):
+        return self.start_in_thread()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                try:
+                    code, fields = await protocol.read_async(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                writer.write(self.execute(code, fields))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    def execute(self, code, fields):
+        """Execute a request, return the packed response."""
+        storage = self.storage
+        try:
+            if code == protocol.GET:
+                key, = fields
+                result = [storage.get(key)]
+            elif code == protocol.GET_MANY:
+                result = storage.get_many(fields)
+            elif code == protocol.SET:
+                key, value, tag = fields
+                storage.set(key, value, tag=protocol.decode_str(tag))
+                result = []
+            elif code == protocol.SET_MANY:
+                tag, *items = fields
+                storage.set_many(
+                    zip(items[::2], items[1::2]),
+                    tag=protocol.decode_str(tag),
+                )
+                result = []
+            elif code == protocol.DELETE:
+                key, = fields
+                try:
+                    del storage[key]
+                except KeyError:
+                    return protocol.pack(protocol.MISS)
+                result = []
+            elif code == protocol.INVALIDATE:
+                storage.invalidate(*map(protocol.decode_str, fields))
+                result = []
+            elif code == protocol.CLEAR:
+                storage.clear()
+                result = []
+            elif code == protocol.LEN:
+                result = [protocol.encode_str(len(storage))]
+            elif code in (protocol.ITEMS, protocol.KEYS):
+                # One page per request, so a large storage does not block
+                # the event loop nor get loaded into memory at once.
+                tag, max_age, ts, key, limit = fields
+                rows = storage.select_page(
+                    code == protocol.ITEMS,
+                    tag=protocol.decode_str(tag),
+                    max_age=protocol.decode_float(max_age),
+                    after=None if ts is None else (float(ts), key),
+                    limit=int(limit),
+                )
+                result = [
+                    x for ts, *row in rows
+                    for x in (protocol.encode_str(repr(ts)), *row)
+                ]
+            elif code == protocol.FLUSH:
+                storage.flush()
+                result = []
+            else:
+                raise ValueError(f'Unknown operation: {code}')
+        except Exception as e:
+            return protocol.pack(
+                protocol.ERROR, [f'{e.__class__.__name__}: {e}'.encode()],
+            )
+        return protocol.pack(protocol.OK, result)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m caching.server',
+        description='Cache server.',
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument(
+        '--path', help='Unix socket path to listen on instead of a port.',
+    )
+    parser.add_argument(
+        '--filepath', default=':memory:',
+        help='Cache file path. The cache is stored in memory by default.',
+    )
+    parser.add_argument('--maxsize', type=int, default=1024)
+    parser.add_argument('--ttl', type=float, default=-1)
+    parser.add_argument(
+        '--policy', default='FIFO', choices=sorted(SQLiteStorage.POLICIES),
+    )
+    args = parser.parse_args(args)
+
+    storage = SQLiteStorage(
+        filepath=args.filepath,
+        maxsize=args.maxsize,
+        ttl=args.ttl,
+        policy=args.policy,
+    )
+    server = CacheServer(storage, host=args.host, port=args.port, path=args.path)
+    try:
+        with suppress(KeyboardInterrupt):
+            asyncio.run(server.serve_forever())
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Per-function accounting of the decorated functions, see the `stats`
+parameter of `Cache`."""
+import sqlite3
+from typing import Dict, Tuple
+
+
+class FunctionStats:
+    """Counters of a decorated function.
+
+    Attributes:
+        hits: number of the calls answered from the cache.
+        misses: number of the calls of the function itself.
+        compute_time: total time in seconds spent in the function.
+        value_bytes: total size of the encoded results stored.
+    """
+
+    __slots__ = ('hits', 'misses', 'compute_time', 'value_bytes')
+
+    def __init__(self, hits=0, misses=0, compute_time=0.0, value_bytes=0):
+        self.hits = hits
+        self.misses = misses
+        self.compute_time = compute_time
+        self.value_bytes = value_bytes
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(hits={self.hits!r}, '
+            f'misses={self.misses!r}, compute_time={self.compute_time!r}, '
+            f'value_bytes={self.value_bytes!r})'
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, FunctionStats):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def values(self) -> Tuple[int, int, float, int]:
+        return self.hits, self.misses, self.compute_time, self.value_bytes
+
+    def add(self, hits=0, misses=0, compute_time=0.0, value_bytes=0):
+        self.hits += hits
+        self.misses += misses
+        self.compute_time += compute_time
+        self.value_bytes += value_bytes
+
+    def take(self) -> Tuple[int, int, float, int]:
+        """Return the counters and reset them."""
+        values = self.values()
+        self.add(*(-v for v in values))
+        return values
+
+    @property
+    def hit_ratio(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    @property
+    def avg_compute_time(self) -> float:
+        return self.compute_time / self.misses if self.misses else 0.0
+
+    @property
+    def avg_value_size(self) -> float:
+        return self.value_bytes / self.misses if self.misses else 0.0
+
+    @property
+    def time_saved(self) -> float:
+        """Estimated time in seconds the hits saved: the number of the hits
+        times the average compute time. The cost of the cache lookups
+        is not subtracted."""
+        return self.hits * self.avg_compute_time
+
+
+def read_stats(filepath: str) -> Dict[str, FunctionStats]:
+    """Read the stats saved in a cache file without modifying the file."""
+    db = sqlite3.connect(f'file:{filepath}?mode=ro', uri=True)
+    try:
+        rows = db.execute(
+            'SELECT function, hits, misses, compute_time, value_bytes '
+            'FROM cache_stats'
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Written by an older version or without stats
+        rows = []
+    finally:
+        db.close()
+    return {name: FunctionStats(*values) for name, *values in rows}
+
+
+def format_report(stats: Dict[str, FunctionStats]) -> str:
+    """Format the stats as a table, the functions saving the most time
+    first."""
+    header = (
+        'function', 'hits', 'misses', 'hit ratio', 'avg time, s',
+        'avg size, B', 'stored, B', 'saved, s',
+    )
+    rows = [header]
+    for name, s in sorted(
+        stats.items(), key=lambda item: item[1].time_saved, reverse=True,
+    ):
+        rows.append((
+            name,
+            str(s.hits),
+            str(s.misses),
+            f'{s.hit_ratio:.1%}',
+            f'{s.avg_compute_time:.6f}',
+            f'{s.avg_value_size:.0f}',
+            str(s.value_bytes),
+            f'{s.time_saved:.3f}',
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join(
+        '  '.join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        ).rstrip()
+        for row in rows
+    )
@@ -1,7 +1,36 @@
+import atexit
 import os
 import sqlite3
+import time
+import weakref
 from contextlib import suppress
-from typing import Generator, Tuple, Union, ByteString
+from typing import Dict, Generator, Iterable, List, Tuple, Union, ByteString
+
+
+_write_behind_storages = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_at_exit():
+    for storage in list(_write_behind_storages):
+        with suppress(sqlite3.Error):
+            storage.flush()
+
+
+_sqlite_storages = weakref.WeakSet()
+# The connections inherited from the parent process are never used nor closed
+# in the child process. They are kept here so they are not closed by
+# the garbage collector either.
+_inherited_connections = []
+
+
+def _reconnect_after_fork():
+    for storage in list(_sqlite_storages):
+        storage.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):  # Python 3.7+
+    os.register_at_fork(after_in_child=_reconnect_after_fork)
 
 
 class CacheStorageBase:
@@ -14,6 +43,23 @@ class CacheStorageBase:
     def __setitem__(self, key: ByteString, value: ByteString) -> None:
         raise NotImplementedError  # pragma: no cover
 
+    def set(
+        self,
+        key: ByteString,
+        value: ByteString,
+        tag: Union[str, None]=None,
+    ) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    def invalidate(self, *tags: str) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    def dump(self, filepath: str) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    def load(self, filepath: str) -> None:
+        raise NotImplementedError  # pragma: no cover
+
     def __getitem__(self, key) -> bytes:
         raise NotImplementedError  # pragma: no cover
 
@@ -32,13 +78,85 @@ class CacheStorageBase:
     def items(self) -> Generator[Tuple[bytes, bytes], None, None]:
         raise NotImplementedError  # pragma: no cover
 
+    def keys(self) -> Generator[bytes, None, None]:
+        raise NotImplementedError  # pragma: no cover
+
+    def values(self) -> Generator[bytes, None, None]:
+        raise NotImplementedError  # pragma: no cover
+
+    def __len__(self) -> int:
+        raise NotImplementedError  # pragma: no cover
+
+    def get_many(
+        self,
+        keys: Iterable[ByteString],
+        default=None,
+    ) -> List[Union[bytes, None]]:
+        return [self.get(key, default) for key in keys]
+
+    def set_many(
+        self,
+        items: Iterable[Tuple[ByteString, ByteString]],
+        tag: Union[str, None]=None,
+    ) -> None:
+        for key, value in items:
+            self.set(key, value, tag=tag)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def save_stats(
+        self,
+        stats: Dict[str, Tuple[int, int, float, int]],
+    ) -> None:
+        """Add the (hits, misses, compute time, value bytes) counters
+        of the functions to the stored ones."""
+        raise NotImplementedError
+
+    def load_stats(self) -> Dict[str, Tuple[int, int, float, int]]:
+        raise NotImplementedError
+
+    def memory_usage(self) -> int:
+        """Number of bytes taken by the stored items."""
+        raise NotImplementedError
+
+    def select_page(
+        self,
+        values: bool,
+        *,
+        tag: Union[str, None]=None,
+        max_age: Union[int, float, None]=None,
+        after: Union[Tuple[float, bytes], None]=None,
+        limit: int,
+    ) -> List[tuple]:
+        """Up to `limit` of the items as (ts, key, value) tuples, or (ts, key)
+        if not `values`, ordered by ts and key, starting after the `after`
+        (ts, key) cursor. Used to page through the items of a storage served
+        by `caching.server.CacheServer`. See `items` for the filters."""
+        raise NotImplementedError
+
 
 class SQLiteStorage(CacheStorageBase):
+    """Cache storage in a SQLite database.
+
+    The database is opened and its schema is created lazily, on the first
+    access to the storage, so creating a storage (e.g. in a module-level
+    `Cache` decorator) costs no I/O.
+    """
+    # Stored in `PRAGMA user_version` and in the `cache_meta` table along with
+    # the parameters the schema depends on. The schema is not touched when
+    # a database with the current schema version and parameters is opened.
+    # Otherwise it is migrated, see `migrate`.
+    SCHEMA_VERSION = 3
     SQLITE_TIMESTAMP = "(julianday('now') - 2440587.5)*86400.0"
     POLICIES = {
         'FIFO': {
             'additional_columns': (),
             'after_get_ok': None,
+            'after_invalidate': None,
             'additional_indexes': (),
             'delete_order_by': 'ts',
         },
@@ -46,46 +164,188 @@ class SQLiteStorage(CacheStorageBase):
             'additional_columns': ('used INT NOT NULL DEFAULT 0',),
             'additional_indexes': ('used, ts',),
             'after_get_ok': 'UPDATE cache SET used = (SELECT max(used) FROM cache) + 1',
+            'after_invalidate': 'UPDATE cache SET used = -1',
             'delete_order_by': 'used, ts',
         },
         'LFU': {
             'additional_columns': ('used INT NOT NULL DEFAULT 0',),
             'additional_indexes': ('used, ts',),
             'after_get_ok': 'UPDATE cache SET used = used + 1',
+            'after_invalidate': 'UPDATE cache SET used = -1',
             'delete_order_by': 'used, ts',
         },
     }
 
-    def __init__(self, *, filepath, ttl, maxsize, policy='FIFO'):
+    def __init__(
+        self,
+        *,
+        filepath,
+        ttl,
+        maxsize,
+        policy='FIFO',
+        write_behind=False,
+        flush_count=100,
+        flush_interval=1.0,
+        cached_statements=128,
+        serializer=None,
+    ):
+        """
+        Args:
+            write_behind: if True then `__setitem__` only queues the item in
+                memory and the queued items are written to the database in
+                a single transaction ("group commit") once `flush_count` items
+                are queued or `flush_interval` seconds have passed since the
+                last flush. Queued items are also flushed on `close()` and at
+                interpreter exit. Queued items are lost on a crash.
+            flush_count: maximum number of queued items in write-behind mode.
+            flush_interval: amount of time in seconds after the last flush
+                when the queued items are flushed on the next `set` or `get`.
+                There is no timer, as the connection can only be used from
+                its own thread, so the items stay queued while the storage
+                is not accessed. Call `flush` to write them explicitly.
+            cached_statements: size of the prepared statements cache of
+                the connection. See `sqlite3.connect`.
+            serializer: name of the format of the stored keys and values,
+                e.g. "pickle". If the database was written with another
+                serializer then it is emptied on opening.
+        """
         if policy not in self.POLICIES:
             raise ValueError(f'Invalid policy: {policy}')
         super(SQLiteStorage, self).__init__(
             ttl=ttl, maxsize=maxsize, policy=policy,
         )
         self.filepath = filepath
-        self.db = sqlite3.connect(filepath, isolation_level='DEFERRED')
-        self.init_db()
+        self.write_behind = write_behind
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.cached_statements = cached_statements
+        self.serializer = serializer
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        if write_behind:
+            _write_behind_storages.add(self)
+        self.closed = False
+        _sqlite_storages.add(self)
         self.nothing = object()
 
         if self.ttl > 0:
             ttl_filter = f'({self.SQLITE_TIMESTAMP} - ts) <= {self.ttl}'
         else:
             ttl_filter = '1=1'
+        # Invalidating a tag increments its generation, the rows stored
+        # with an older generation of their tag are not visible anymore.
+        gen_filter = (
+            '(tag IS NULL OR gen = coalesce('
+            '(SELECT g.gen FROM cache_generations g WHERE g.tag = cache.tag), 0))'
+        )
+        current_gen = (
+            'coalesce((SELECT gen FROM cache_generations WHERE tag = ?), 0)'
+        )
 
-        self.sql_select = f'SELECT value FROM cache WHERE key = ? AND {ttl_filter}'
-        self.sql_select_kv = f'SELECT key, value FROM cache WHERE {ttl_filter} ORDER BY ts'
+        self.sql_filter = f'{ttl_filter} AND {gen_filter}'
+        self.sql_select = (
+            f'SELECT value FROM cache WHERE key = ? AND {self.sql_filter}'
+        )
+        self.sql_count = "SELECT value FROM cache_meta WHERE key = 'count'"
         self.sql_delete = 'DELETE FROM cache WHERE key = ?'
         self.sql_insert = (
-            'INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)'
+            f'INSERT OR REPLACE INTO cache (key, value, tag, gen) '
+            f'VALUES (?, ?, ?, {current_gen})'
+        )
+        self.sql_insert_ts = (
+            f'INSERT OR REPLACE INTO cache (key, ts, value, tag, gen) '
+            f'VALUES (?, ?, ?, ?, {current_gen})'
+        )
+        self.sql_invalidate = (
+            'INSERT INTO cache_generations (tag, gen) VALUES (?, 1) '
+            'ON CONFLICT (tag) DO UPDATE SET gen = gen + 1'
         )
         after_get_ok = self.POLICIES[self.policy]['after_get_ok']
         if after_get_ok:
             self.sql_after_get_ok = f'{after_get_ok} WHERE key = ?'
         else:
             self.sql_after_get_ok = None
+        after_invalidate = self.POLICIES[self.policy]['after_invalidate']
+        if after_invalidate:
+            self.sql_after_invalidate = f'{after_invalidate} WHERE tag = ?'
+        else:
+            self.sql_after_invalidate = None
+
+    def __getattr__(self, name):
+        # Called only until the connection is open, when the `db` and `cursor`
+        # attributes do not exist yet.
+        if name not in ('db', 'cursor'):
+            raise AttributeError(name)
+        if self.closed:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        try:
+            self.connect()
+            self.init_db()
+        except BaseException:
+            # E.g. the database is locked by another process. The next
+            # access opens the database again and retries.
+            self.__dict__.pop('cursor', None)
+            db = self.__dict__.pop('db', None)
+            if db is not None:
+                db.close()
+            raise
+        return getattr(self, name)
+
+    @property
+    def connected(self):
+        return 'db' in self.__dict__
+
+    def connect(self):
+        self.db = sqlite3.connect(
+            self.filepath,
+            isolation_level='DEFERRED',
+            cached_statements=self.cached_statements,
+        )
+        # A long-lived cursor for the single-row queries,
+        # saves creating a cursor object per query.
+        self.cursor = self.db.cursor()
+        # Makes the rows replaced by INSERT OR REPLACE fire the DELETE
+        # triggers, which is needed to maintain the count of the rows.
+        self.db.execute('PRAGMA recursive_triggers = ON')
+
+    def after_fork(self):
+        """Called in the child process after `os.fork()`.
+
+        A SQLite connection must not be used in a forked process, so a new
+        one is opened to the same file. In-memory databases are copied
+        by the fork and stay private to each process, so their connections
+        are kept as is.
+        """
+        if self.filepath == ':memory:':
+            return
+        # The items queued in write-behind mode are flushed by the parent.
+        self.pending.clear()
+        if not self.connected:
+            return
+        _inherited_connections.append(self.db)
+        self.connect()
 
     def close(self):
-        self.db.close()
+        if self.pending:
+            self.flush()
+        _write_behind_storages.discard(self)
+        _sqlite_storages.discard(self)
+        self.closed = True
+        if self.connected:
+            self.db.close()
+
+    def flush(self):
+        """Write the items queued in write-behind mode in one transaction."""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        rows = [
+            (k, ts, v, tag, tag)
+            for k, (ts, v, tag) in self.pending.items()
+        ]
+        self.pending.clear()
+        with self.db as db:
+            db.executemany(self.sql_insert_ts, rows)
 
     def __repr__(self):
         params = (
@@ -105,8 +365,49 @@ class SQLiteStorage(CacheStorageBase):
         self.close()
 
     def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, tag=None):
+        if self.write_behind:
+            self.pending[key] = (time.time(), value, tag)
+            if len(self.pending) >= self.flush_count:
+                self.flush()
+            else:
+                self.flush_if_due()
+        else:
+            with self.db:
+                self.cursor.execute(self.sql_insert, (key, value, tag, tag))
+
+    def set_many(self, items, tag=None):
+        """Store the items in a single transaction."""
+        if self.write_behind:
+            super(SQLiteStorage, self).set_many(items, tag=tag)
+        else:
+            with self.db:
+                self.cursor.executemany(
+                    self.sql_insert,
+                    ((key, value, tag, tag) for key, value in items),
+                )
+
+    def invalidate(self, *tags):
+        """Invalidate all the items stored with any of the `tags`.
+
+        A generation counter per tag is updated, the invalidated rows
+        are left to be deleted by ttl and maxsize cleanup. For LRU and LFU
+        their policy counters are reset below those of any valid row, so they
+        are evicted first. The invalidation is visible to all the processes
+        which use the same database file.
+        """
+        tags = set(tags)
+        if self.pending:
+            self.pending = {
+                k: item for k, item in self.pending.items()
+                if item[2] not in tags
+            }
         with self.db as db:
-            db.execute(self.sql_insert, (key, value))
+            db.executemany(self.sql_invalidate, ((t,) for t in tags))
+            if self.sql_after_invalidate:
+                db.executemany(self.sql_after_invalidate, ((t,) for t in tags))
 
     def __getitem__(self, key):
         res = self.get(key, None)
@@ -116,75 +417,395 @@ class SQLiteStorage(CacheStorageBase):
             return res
 
     def __delitem__(self, key):
-        cursor = self.db.execute(self.sql_delete, (key,))
+        if self.pending:
+            self.flush()
+        with self.db:
+            cursor = self.cursor.execute(self.sql_delete, (key,))
         if cursor.rowcount == 0:
             raise KeyError('Not found')
 
+    def flush_if_due(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
     def get(self, key, default=None):
-        with self.db:
-            rows = self.db.execute(
-                self.sql_select,
-                (key,),
-            ).fetchall()
-            if rows:
-                if self.sql_after_get_ok:
-                    self.db.execute(self.sql_after_get_ok, (key,))
-                return rows[0][0]
-            else:
-                return default
+        if self.pending:
+            self.flush_if_due()
+        if self.pending:
+            item = self.pending.get(key)
+            if item is not None:
+                ts, value, _ = item
+                if self.ttl > 0 and time.time() - ts > self.ttl:
+                    return default
+                return value
+        # The key is unique so fetchone() exhausts the query and the statement
+        # is reset, no read lock is held after it.
+        row = self.cursor.execute(self.sql_select, (key,)).fetchone()
+        if row is None:
+            return default
+        if self.sql_after_get_ok:
+            with self.db:
+                self.cursor.execute(self.sql_after_get_ok, (key,))
+        return row[0]
 
-    def init_db(self):
+    def cleanup_actions(self):
+        """SQL statements deleting the expired and the excess items."""
         policy_stuff = self.POLICIES[self.policy]
 
-        after_insert_actions = []
+        actions = []
         if self.ttl > 0:
-            after_insert_actions.append(f'''
+            actions.append(f'''
                 DELETE FROM cache WHERE
                 ({self.SQLITE_TIMESTAMP} - ts) > {self.ttl};
             ''')
         if self.maxsize > 0:
-            after_insert_actions.append(f'''
+            actions.append(f'''
                 DELETE FROM cache WHERE key in (
                     SELECT key FROM cache
                     ORDER BY {policy_stuff['delete_order_by']}
                     LIMIT max(0, (SELECT COUNT(key) FROM cache) - {self.maxsize})
                 );
             ''')
+        return actions
 
+    def init_db(self):
+        version, = self.db.execute('PRAGMA user_version').fetchone()
+        if version == self.SCHEMA_VERSION and self.schema_is_current():
+            return
         with self.db as db:
-            db.execute(f'''
-                CREATE TABLE IF NOT EXISTS cache (
-                    key BINARY PRIMARY KEY,
-                    ts REAL NOT NULL DEFAULT ({self.SQLITE_TIMESTAMP}),
-                    {''.join(f"{c}, " for c in policy_stuff['additional_columns'])}
-                    value BLOB NOT NULL
-                ) WITHOUT ROWID
-            ''')
-            db.execute('CREATE INDEX IF NOT EXISTS i_cache_ts ON cache (ts)')
+            # Not letting other processes migrate the database concurrently
+            db.execute('BEGIN IMMEDIATE')
+            self.migrate(db)
+            db.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def schema_params(self):
+        params = {
+            'schema_version': self.SCHEMA_VERSION,
+            'policy': self.policy,
+            'ttl': self.ttl,
+            'maxsize': self.maxsize,
+        }
+        if self.serializer is not None:
+            params['serializer'] = self.serializer
+        return params
+
+    def schema_is_current(self):
+        meta = dict(self.db.execute('SELECT key, value FROM cache_meta'))
+        return all(
+            meta.get(k) == v for k, v in self.schema_params().items()
+        )
+
+    def migrate(self, db):
+        """Bring the schema of an existing database in line with the current
+        schema version and parameters of the storage, keeping the items.
+
+        The missing columns are added in place. If the table has columns which
+        are not needed anymore (e.g. the policy was changed from LRU to FIFO)
+        it is rebuilt by copying the rows to a new table within the database.
+        The indexes and triggers depending on the parameters are recreated,
+        the expired and the excess items are deleted. If the serializer
+        has changed, then all the items are deleted.
+        """
+        columns = self.table_columns('main', 'cache')
+        if columns:
+            if self.table_columns('main', 'cache_meta'):
+                meta = dict(db.execute('SELECT key, value FROM cache_meta'))
+            else:
+                meta = {}
+            definitions = self.column_definitions()
+            if set(columns) - set(definitions):
+                common = ', '.join(c for c in columns if c in definitions)
+                db.execute(self.sql_create_table('cache_rebuild'))
+                db.execute(
+                    f'INSERT INTO cache_rebuild ({common}) '
+                    f'SELECT {common} FROM cache'
+                )
+                db.execute('DROP TABLE cache')
+                db.execute('ALTER TABLE cache_rebuild RENAME TO cache')
+            else:
+                for name, definition in definitions.items():
+                    if name not in columns:
+                        db.execute(f'ALTER TABLE cache ADD COLUMN {definition}')
+            db.execute('DROP TRIGGER IF EXISTS t_cache_cleanup')
+            indexes = db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name = 'cache' AND name != 'i_cache_ts' "
+                "AND sql IS NOT NULL"
+            ).fetchall()
+            for name, in indexes:
+                db.execute(f'DROP INDEX {name}')
+            serializer = meta.get('serializer')
+            if serializer and self.serializer and serializer != self.serializer:
+                db.execute('DELETE FROM cache')
+
+        self.create_schema(db)
+        db.execute(
+            "UPDATE cache_meta SET value = (SELECT count(*) FROM cache) "
+            "WHERE key = 'count'"
+        )
+        for action in self.cleanup_actions():
+            db.execute(action)
+        db.executemany(
+            'INSERT OR REPLACE INTO cache_meta (key, value) VALUES (?, ?)',
+            self.schema_params().items(),
+        )
 
-            for i, columns in enumerate(policy_stuff['additional_indexes']):
-                db.execute(f'CREATE INDEX IF NOT EXISTS i_cache_{i} ON cache ({columns})')
+    def column_definitions(self):
+        return {
+            definition.split()[0]: definition
+            for definition in (
+                'key BINARY PRIMARY KEY',
+                f'ts REAL NOT NULL DEFAULT ({self.SQLITE_TIMESTAMP})',
+                *self.POLICIES[self.policy]['additional_columns'],
+                'tag TEXT',
+                'gen INT NOT NULL DEFAULT 0',
+                'value BLOB NOT NULL',
+            )
+        }
 
-            if after_insert_actions:
-                db.execute('''
-                    CREATE TRIGGER IF NOT EXISTS t_cache_cleanup
-                    AFTER INSERT ON cache FOR EACH ROW BEGIN
-                        %s
-                    END
-                ''' % '\n'.join(after_insert_actions))
+    def sql_create_table(self, name):
+        return (
+            f'CREATE TABLE IF NOT EXISTS {name} '
+            f"({', '.join(self.column_definitions().values())}) WITHOUT ROWID"
+        )
+
+    def create_schema(self, db):
+        policy_stuff = self.POLICIES[self.policy]
+        after_insert_actions = self.cleanup_actions()
+
+        db.execute(self.sql_create_table('cache'))
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS cache_generations (
+                tag TEXT PRIMARY KEY,
+                gen INT NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                key TEXT PRIMARY KEY,
+                value
+            ) WITHOUT ROWID
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                function TEXT PRIMARY KEY,
+                hits INT NOT NULL,
+                misses INT NOT NULL,
+                compute_time REAL NOT NULL,
+                value_bytes INT NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        db.execute('''
+            INSERT OR IGNORE INTO cache_meta (key, value)
+            VALUES ('count', (SELECT count(*) FROM cache))
+        ''')
+        db.execute('''
+            CREATE TRIGGER IF NOT EXISTS t_cache_count_insert
+            AFTER INSERT ON cache FOR EACH ROW BEGIN
+                UPDATE cache_meta SET value = value + 1 WHERE key = 'count';
+            END
+        ''')
+        db.execute('''
+            CREATE TRIGGER IF NOT EXISTS t_cache_count_delete
+            AFTER DELETE ON cache FOR EACH ROW BEGIN
+                UPDATE cache_meta SET value = value - 1 WHERE key = 'count';
+            END
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS i_cache_ts ON cache (ts)')
+
+        for i, columns in enumerate(policy_stuff['additional_indexes']):
+            db.execute(f'CREATE INDEX IF NOT EXISTS i_cache_{i} ON cache ({columns})')
+
+        if after_insert_actions:
+            db.execute('''
+                CREATE TRIGGER IF NOT EXISTS t_cache_cleanup
+                AFTER INSERT ON cache FOR EACH ROW BEGIN
+                    %s
+                END
+            ''' % '\n'.join(after_insert_actions))
+
+    def save_stats(self, stats):
+        with self.db as db:
+            db.executemany(
+                'INSERT INTO cache_stats '
+                '(function, hits, misses, compute_time, value_bytes) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (function) DO UPDATE SET '
+                'hits = hits + excluded.hits, '
+                'misses = misses + excluded.misses, '
+                'compute_time = compute_time + excluded.compute_time, '
+                'value_bytes = value_bytes + excluded.value_bytes',
+                [(name, *values) for name, values in stats.items()],
+            )
+
+    def load_stats(self):
+        return {
+            name: tuple(values)
+            for name, *values in self.db.execute(
+                'SELECT function, hits, misses, compute_time, value_bytes '
+                'FROM cache_stats'
+            )
+        }
+
+    def memory_usage(self):
+        """Size of the database in bytes (page count times page size),
+        plus the size of the items queued in write-behind mode. For
+        an in-memory database it is the memory taken by the items and
+        the indexes, for a file database it is the size of the file."""
+        page_count, = self.db.execute('PRAGMA page_count').fetchone()
+        page_size, = self.db.execute('PRAGMA page_size').fetchone()
+        return page_count * page_size + sum(
+            len(key) + len(value) for key, (ts, value, tag) in self.pending.items()
+        )
 
     def clear(self):
+        self.pending.clear()
         with self.db as db:
-            db.execute('DROP TABLE IF EXISTS cache')
-            db.execute('VACUUM')
-        self.init_db()
+            db.execute('DELETE FROM cache')
 
-    def items(self):
-        cursor = self.db.execute(self.sql_select_kv)
+    def dump(self, filepath):
+        """Save a snapshot of the database to `filepath` using SQLite online
+        backup API. Timestamps, policy counters and tag generations are
+        preserved."""
+        self.flush()
+        target = sqlite3.connect(filepath)
         try:
-            yield from cursor
+            self.db.backup(target)
         finally:
-            cursor.close()
+            target.close()
+
+    def load(self, filepath):
+        """Bulk load the items from a snapshot made by `dump` or from another
+        cache file.
+
+        Only the items valid in the snapshot are loaded, they are stored
+        with the current generations of their tags in this database.
+        The items are loaded in a single transaction. The indexes and
+        the cleanup trigger are dropped for the load and recreated after it,
+        then the expired and the excess items are deleted once.
+        """
+        self.flush()
+        self.db.execute('ATTACH DATABASE ? AS snapshot', (filepath,))
+        try:
+            snapshot_columns = self.table_columns('snapshot', 'cache')
+            columns = [
+                c for c in self.table_columns('main', 'cache')
+                if c in snapshot_columns and c != 'gen'
+            ]
+            expressions = [f's.{c}' for c in columns]
+            condition = '1'
+            if 'tag' in snapshot_columns:
+                # The rows are stored with the current generation of their
+                # tag in this database, so the tags invalidated here before
+                # the load do not hide them.
+                columns.append('gen')
+                expressions.append(
+                    'coalesce((SELECT g.gen FROM main.cache_generations g '
+                    'WHERE g.tag = s.tag), 0)'
+                )
+                if (
+                    'gen' in snapshot_columns
+                    and self.table_columns('snapshot', 'cache_generations')
+                ):
+                    # Only the rows not invalidated in the snapshot
+                    condition = (
+                        's.tag IS NULL OR s.gen = coalesce((SELECT g.gen '
+                        'FROM snapshot.cache_generations g '
+                        'WHERE g.tag = s.tag), 0)'
+                    )
+            with self.db as db:
+                db.execute('BEGIN')
+                db.execute('DROP TRIGGER IF EXISTS t_cache_cleanup')
+                indexes = db.execute(
+                    "SELECT name FROM sqlite_master "
+                    "WHERE type = 'index' AND tbl_name = 'cache' "
+                    "AND sql IS NOT NULL"
+                ).fetchall()
+                for name, in indexes:
+                    db.execute(f'DROP INDEX {name}')
+                db.execute(
+                    f"INSERT OR REPLACE INTO main.cache ({', '.join(columns)}) "
+                    f"SELECT {', '.join(expressions)} FROM snapshot.cache s "
+                    f'WHERE {condition}'
+                )
+                self.create_schema(db)
+                for action in self.cleanup_actions():
+                    db.execute(action)
+        finally:
+            self.db.execute('DETACH DATABASE snapshot')
+
+    def table_columns(self, schema, table):
+        return [
+            row[1] for row in
+            self.db.execute(f'PRAGMA {schema}.table_info({table})')
+        ]
+
+    def items(self, *, tag=None, max_age=None, batch_size=1000):
+        """Iterate over the items ordered by the time they were stored.
+
+        Args:
+            tag: only the items stored with the tag.
+            max_age: only the items stored not more than `max_age` seconds ago.
+            batch_size: number of rows fetched from the database at a time.
+                The database is not locked between the batches.
+        """
+        for ts, key, value in self.select_batches(
+            True, tag, max_age, batch_size,
+        ):
+            yield key, value
+
+    def keys(self, *, tag=None, max_age=None, batch_size=1000):
+        """Same as `items` but the values are not fetched."""
+        for ts, key in self.select_batches(False, tag, max_age, batch_size):
+            yield key
+
+    def values(self, *, tag=None, max_age=None, batch_size=1000):
+        """Same as `items` but only the values are returned."""
+        for ts, key, value in self.select_batches(
+            True, tag, max_age, batch_size,
+        ):
+            yield value
+
+    def select_batches(self, values, tag, max_age, batch_size):
+        after = None
+        while True:
+            rows = self.select_page(
+                values, tag=tag, max_age=max_age, after=after,
+                limit=batch_size,
+            )
+            yield from rows
+            if len(rows) < batch_size:
+                break
+            after = rows[-1][:2]
+
+    def select_page(self, values, *, tag=None, max_age=None, after=None, limit):
+        if self.pending:
+            self.flush()
+        conditions = [self.sql_filter]
+        params = []
+        if tag is not None:
+            conditions.append('tag = ?')
+            params.append(tag)
+        if max_age is not None:
+            conditions.append(f'({self.SQLITE_TIMESTAMP} - ts) <= ?')
+            params.append(max_age)
+        if after is not None:
+            conditions.append('(ts, key) > (?, ?)')
+            params.extend(after)
+        columns = ', value' if values else ''
+        return self.db.execute(
+            f'SELECT ts, key{columns} FROM cache '
+            f"WHERE {' AND '.join(conditions)} ORDER BY ts, key LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+
+    def __len__(self):
+        """Number of the stored items. The count is maintained by triggers so
+        this is O(1), but the items which are expired or invalidated and not
+        yet deleted are counted too."""
+        if self.pending:
+            self.flush()
+        return self.db.execute(self.sql_count).fetchone()[0]
 
     def remove(self):
         self.close()
@@ -1,10 +1,19 @@
+import gc
+import json
+import math
+import multiprocessing
 import os
+import pickle
 import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 
 import pytest
 
-from caching import Cache
-from caching.cache import _type_name, _function_name, _type_names, make_key
+from caching import Cache, MemoryStorage, Refresher
+from caching.cache import (
+    NegativeEntry, _type_name, _function_name, _type_names, make_key,
+)
 
 
 @pytest.fixture(params=[False, True], ids=['memory', 'file'])
@@ -18,7 +27,10 @@ def test_repr():
     c = Cache(maxsize=1, ttl=1, filepath=None, policy='FIFO', only_on_errors=False, x='y')
     expected = (
         "Cache(maxsize=1, ttl=1, filepath=None, policy='FIFO', "
-        f"key={make_key}, only_on_errors=False, x='y')"
+        f"key={make_key}, only_on_errors=False, write_behind=False, "
+        "flush_count=100, flush_interval=1.0, tag=None, cache_exceptions=(), "
+        "negative_results=(), negative_ttl=60, storage=None, refresher=None, "
+        "stats=False, x='y')"
     )
     assert repr(c) == expected
 
@@ -174,9 +186,11 @@ def test_remove(tmpdir, cache):
     cache.remove()
     filepath = f'{tmpdir}/cache'
     cache = Cache(filepath=filepath)
+    # The file is created lazily
+    assert os.listdir(tmpdir) == []
+    cache[1] = 'one'
     assert os.path.isfile(filepath)
     assert os.listdir(tmpdir) == ['cache']
-    cache[1] = 'one'
     cache[2] = 'two'
     assert os.path.isfile(filepath)
     assert os.listdir(tmpdir) == ['cache']
@@ -210,6 +224,45 @@ def test_types(cache):
     assert call_count == 2
 
 
+@pytest.mark.parametrize('args, kwargs', [
+    ((), {}),
+    ((1, 'a'), {}),
+    ((), {'b': 2, 'a': 1}),
+    (([1], {2: 3}), {'c': None}),
+])
+def test_decorator_keys_match_make_key(args, kwargs):
+    cache = Cache()
+
+    @cache
+    def func(*args, **kwargs):
+        return 1
+
+    func(*args, **kwargs)
+    assert list(cache.keys()) == [
+        (_function_name(func), *make_key(*args, **kwargs)),
+    ]
+
+
+def test_decorator_custom_encoding():
+    class JSONCache(Cache):
+        serializer = 'json'
+
+        def encode(self, obj):
+            return json.dumps(obj).encode()
+
+        def decode(self, data):
+            return json.loads(data)
+
+    cache = JSONCache()
+
+    @cache
+    def func(a):
+        return [a]
+
+    assert func(1) == func(1) == [1]
+    assert list(cache.storage.values()) == [b'[1]']
+
+
 def test_make_key():
     assert make_key(1) == (1,)
     assert make_key() == ()
@@ -366,3 +419,411 @@ def test_only_on_errors():
     fn._cache.clear()
     with pytest.raises(ZeroDivisionError):
         fn()
+
+
+def test_write_behind(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    cache = Cache(filepath=filepath, write_behind=True, flush_count=3)
+    cache[1] = 'one'
+    cache[2] = 'two'
+    assert cache[1] == 'one'
+    with Cache(filepath=filepath) as other:
+        assert 1 not in other
+    cache[3] = 'three'
+    with Cache(filepath=filepath) as other:
+        assert [k for k, v in other.items()] == [1, 2, 3]
+    cache[4] = 'four'
+    cache.close()
+    with Cache(filepath=filepath) as other:
+        assert other[4] == 'four'
+
+
+def test_invalidate(cache):
+    call_count = 0
+
+    @cache
+    def func(a):
+        nonlocal call_count
+        call_count += 1
+        return a
+
+    @cache
+    def other(a):
+        return a
+
+    assert func(1) == other(1) == 1
+    assert func(1) == 1
+    assert call_count == 1
+
+    cache.invalidate(func)
+    assert [k for k, v in cache.items()] == [(_function_name(other), 1)]
+    assert func(1) == 1
+    assert call_count == 2
+    assert func(1) == 1
+    assert call_count == 2
+
+    cache.set('a', 1, tag='letters')
+    cache.set('b', 2, tag='letters')
+    cache['c'] = 3
+    cache.invalidate('letters', 'unknown')
+    assert 'a' not in cache and 'b' not in cache
+    assert cache['c'] == 3
+    cache.set('a', 10, tag='letters')
+    assert cache['a'] == 10
+
+
+def test_invalidate_tag_param(cache):
+    call_count = 0
+
+    @cache(tag='numbers')
+    def func(a):
+        nonlocal call_count
+        call_count += 1
+        return a
+
+    func(1)
+    func(1)
+    assert call_count == 1
+    func._cache.invalidate('numbers')
+    func(1)
+    assert call_count == 2
+
+
+def test_invalidate_other_process(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    with Cache(filepath=filepath) as c1, Cache(filepath=filepath) as c2:
+        c1.set(1, 'one', tag='t')
+        assert c2[1] == 'one'
+        c2.invalidate('t')
+        assert 1 not in c1
+
+
+def test_dump_load(tmpdir, cache):
+    snapshot = f'{tmpdir}/snapshot'
+
+    @cache
+    def func(a):
+        return a
+
+    func(1)
+    cache[2] = 'two'
+    cache.dump(snapshot)
+
+    with Cache() as warm:
+        warm.load(snapshot)
+        assert list(warm.items()) == list(cache.items())
+        warm.invalidate(func)
+        assert list(warm.items()) == [(2, 'two')]
+
+
+def test_keys_values_len(cache):
+    @cache
+    def func(a):
+        return a * 2
+
+    assert len(cache) == 0
+    cache['x'] = 'y'
+    func(1)
+    time.sleep(0.001)
+    func(2)
+    assert len(cache) == 3
+    time.sleep(0.001)
+    cache['x'] = 'z'
+    assert len(cache) == 3
+    assert list(cache.keys(batch_size=2)) == [
+        (_function_name(func), 1), (_function_name(func), 2), 'x',
+    ]
+    assert list(cache.values(batch_size=1)) == [2, 4, 'z']
+    assert list(cache.items(tag=func)) == [
+        ((_function_name(func), 1), 2),
+        ((_function_name(func), 2), 4),
+    ]
+    with cache.storage.db as db:
+        db.execute('UPDATE cache SET ts = ts - 100')
+    func(3)
+    assert list(cache.values(max_age=50)) == [6]
+    del cache['x']
+    assert len(cache) == 3
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cache_exceptions(cache):
+    call_count = 0
+
+    @cache(cache_exceptions=(KeyError, ValueError), negative_ttl=0.01)
+    def func(a):
+        nonlocal call_count
+        call_count += 1
+        if a == 'key':
+            raise KeyError(a)
+        if a == 'zero':
+            1 / 0
+        return a
+
+    for _ in range(2):
+        with pytest.raises(KeyError) as e:
+            func('key')
+        assert e.value.args == ('key',)
+    assert call_count == 1
+
+    for _ in range(2):
+        with pytest.raises(ZeroDivisionError):
+            func('zero')
+    assert call_count == 3
+
+    time.sleep(0.011)
+    with pytest.raises(KeyError):
+        func('key')
+    assert call_count == 4
+
+
+def test_cache_unpicklable_exception(cache):
+    class Error(Exception):
+        pass
+
+    call_count = 0
+
+    @cache(cache_exceptions=Error)
+    def func():
+        nonlocal call_count
+        call_count += 1
+        raise Error
+
+    for _ in range(2):
+        with pytest.raises(Error):
+            func()
+    assert call_count == 2
+
+
+class NotFound(LookupError):
+    def __init__(self, kind, ident):
+        super().__init__(f'{kind} {ident} not found')
+
+
+def test_cache_exception_not_unpicklable(cache):
+    call_count = 0
+
+    @cache(cache_exceptions=NotFound)
+    def func(a):
+        nonlocal call_count
+        call_count += 1
+        if a is None:
+            raise NotFound('user', a)
+        return a
+
+    for _ in range(2):
+        with pytest.raises(NotFound):
+            func(None)
+    assert call_count == 2
+
+    # An item which can not be decoded is a miss and is replaced
+    assert func(1) == 1
+    entry = NegativeEntry(math.inf, exception=NotFound('user', 1))
+    storage = func._cache.storage
+    for key in list(storage.keys()):
+        storage[key] = pickle.dumps(entry)
+    assert func(1) == func(1) == 1
+    assert call_count == 4
+
+
+def test_negative_results(cache):
+    call_count = 0
+
+    @cache(negative_results=(None,), negative_ttl=0.01)
+    def func(a):
+        nonlocal call_count
+        call_count += 1
+        return a
+
+    assert func(None) is None
+    assert func(None) is None
+    assert call_count == 1
+    time.sleep(0.011)
+    assert func(None) is None
+    assert call_count == 2
+    assert func(1) == func(1) == 1
+    assert call_count == 3
+
+
+def test_method(cache):
+    call_count = 0
+
+    class Point:
+        def __init__(self, x):
+            self.x = x
+
+        @cache.method
+        def add(self, y):
+            nonlocal call_count
+            call_count += 1
+            return self.x + y
+
+    a, b = Point(1), Point(10)
+    assert a.add(1) == a.add(1) == 2
+    assert b.add(1) == b.add(y=1) == 11
+    assert call_count == 3
+    assert Point.add.__name__ == 'add'
+    assert len(cache) == 3
+
+    del a
+    gc.collect()
+    assert b.add(1) == 11
+    assert call_count == 3
+    assert len(cache) == 2
+
+    cache.invalidate(Point.add)
+    assert b.add(1) == 11
+    assert call_count == 4
+
+
+def test_method_cache_key(cache):
+    call_count = 0
+
+    class User:
+        __slots__ = ('id',)
+
+        def __init__(self, id):
+            self.id = id
+
+        def __cache_key__(self):
+            return self.id
+
+        @cache.method
+        def name(self):
+            nonlocal call_count
+            call_count += 1
+            return f'user{self.id}'
+
+    assert User(1).name() == User(1).name() == 'user1'
+    assert call_count == 1
+    assert User(2).name() == 'user2'
+    assert call_count == 2
+
+
+def test_method_not_weakrefable(cache):
+    class Slotted:
+        __slots__ = ()
+
+        @cache.method
+        def method(self):
+            return 1
+
+    with pytest.raises(TypeError):
+        Slotted().method()
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'fork'), reason='fork is not available',
+)
+def test_method_shared_file(tmpdir):
+    cache = Cache(filepath=f'{tmpdir}/cache')
+
+    class Account:
+        def __init__(self, name):
+            self.name = name
+
+        @cache.method
+        def balance(self):
+            return f'balance of {self.name}'
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    results = []
+    for name in ['alice', 'bob']:
+        # One after another, so the instances get the same ids in the children
+        process = context.Process(
+            target=lambda: queue.put(Account(name).balance()),
+        )
+        process.start()
+        results.append(queue.get(timeout=10))
+        process.join()
+    assert results == ['balance of alice', 'balance of bob']
+
+
+def test_method_per_instance():
+    call_count = 0
+    cache = Cache(maxsize=2, ttl=0.01)
+
+    class Point:
+        __slots__ = ('x', '_add_cache', '__weakref__')
+
+        def __init__(self, x):
+            self.x = x
+
+        def __radd__(self, other):
+            return self
+
+        @cache.method(per_instance=True)
+        def add(self, y):
+            nonlocal call_count
+            call_count += 1
+            return self.x + y
+
+        @cache.method(per_instance=True)
+        def not_in_slots(self):
+            return self.x
+
+    a = Point(1)
+    assert a.add(1) == a.add(1) == 2
+    assert a.add([1][0]) == 2
+    assert call_count == 1
+    assert Point(2).add(1) == 3
+    assert call_count == 2
+    assert len(cache) == 0
+
+    a.add(2)
+    a.add(3)
+    assert list(a._add_cache) == [(2,), (3,)]
+    time.sleep(0.011)
+    assert a.add(3) == 4
+    assert call_count == 5
+
+    with pytest.raises(TypeError):
+        a.not_in_slots()
+
+    # The cached results are freed with the instance
+    a.add(Point(5))
+    ref = weakref.ref(next(reversed(a._add_cache))[0])
+    del a
+    gc.collect()
+    assert ref() is None
+
+
+def test_pickle(tmpdir):
+    cache = Cache(filepath=f'{tmpdir}/cache', ttl=10, policy='LRU')
+    cache[1] = 'one'
+    restored = pickle.loads(pickle.dumps(cache))
+    assert restored is not cache
+    assert repr(restored) == repr(cache)
+    assert restored[1] == 'one'
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'storage': MemoryStorage()},
+    {'refresher': Refresher()},
+])
+def test_pickle_explicit_storage_or_refresher(kwargs):
+    cache = Cache(**kwargs)
+    with pytest.raises(TypeError, match=list(kwargs)[0]):
+        pickle.dumps(cache)
+
+
+def _square(x):
+    return x * x
+
+
+def _cached_square(cache, x):
+    return cache(_square)(x)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'fork'), reason='fork is not available',
+)
+def test_process_pool(tmpdir):
+    cache = Cache(filepath=f'{tmpdir}/cache')
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(2, mp_context=context) as executor:
+        results = executor.map(_cached_square, [cache] * 3, [1, 2, 3])
+        assert list(results) == [1, 4, 9]
+    assert sorted(v for k, v in cache.items()) == [1, 4, 9]
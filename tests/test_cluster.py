@@ -0,0 +1,133 @@
+from contextlib import ExitStack
+
+import pytest
+
+from caching import Cache, RemoteStorage, SQLiteStorage
+from caching.cluster import ClusterStorage
+from caching.server import CacheServer
+
+
+def memory_storage():
+    return SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=1000)
+
+
+@pytest.fixture
+def servers():
+    with ExitStack() as stack:
+        yield [
+            stack.enter_context(CacheServer(memory_storage()))
+            for _ in range(3)
+        ]
+
+
+@pytest.fixture
+def cluster(servers):
+    storage = ClusterStorage(
+        [RemoteStorage(s.address, timeout=5) for s in servers],
+    )
+    yield storage
+    storage.close()
+
+
+keys = [b'%d' % i for i in range(300)]
+
+
+def test_set_get(cluster):
+    for key in keys:
+        cluster[key] = key
+    assert all(cluster[key] == key for key in keys)
+    assert len(cluster) == len(keys)
+    # The keys are spread over all the nodes
+    sizes = [len(node) for node in cluster.nodes.values()]
+    assert all(size > 50 for size in sizes)
+    del cluster[keys[0]]
+    with pytest.raises(KeyError):
+        del cluster[keys[0]]
+    assert cluster.get(keys[0]) is None
+    cluster.clear()
+    assert len(cluster) == 0
+
+
+def test_many(cluster):
+    cluster.set_many(((k, k + b'!') for k in keys), tag='t')
+    assert cluster.get_many([*keys, b'x'], b'-') == [
+        *(k + b'!' for k in keys), b'-',
+    ]
+    assert sorted(cluster.keys()) == sorted(keys)
+    assert sorted(cluster.values(tag='t')) == sorted(k + b'!' for k in keys)
+    cluster.invalidate('t')
+    assert cluster.get_many(keys) == [None] * len(keys)
+
+
+def test_rehashing():
+    nodes = {str(i): memory_storage() for i in range(4)}
+    before = ClusterStorage({k: nodes[k] for k in '012'}, max_workers=0)
+    after = ClusterStorage(nodes, max_workers=0)
+    moved = [k for k in keys if before.node_name(k) != after.node_name(k)]
+    # Only the keys of the new node are moved
+    assert all(after.node_name(k) == '3' for k in moved)
+    assert 0 < len(moved) < len(keys) / 2
+
+
+def test_node_down(servers, cluster):
+    cluster.set_many((k, k) for k in keys)
+    down = servers[0]
+    down_name = repr(RemoteStorage(down.address))
+    addresses = [s.address for s in servers]
+    down.close()
+
+    on_down_node = [k for k in keys if cluster.node_name(k) == down_name]
+    assert on_down_node
+    up = sorted(k for k in keys if k not in on_down_node)
+    # The remote nodes connect lazily, on iteration
+    for method in ('items', 'keys', 'values'):
+        fresh = ClusterStorage(
+            [RemoteStorage(address, timeout=5) for address in addresses],
+        )
+        results = list(getattr(fresh, method)())
+        if method == 'items':
+            results = [key for key, value in results]
+        assert sorted(results) == up
+        assert down_name in fresh.down_until
+        fresh.close()
+
+    for key in on_down_node[:3]:
+        assert cluster.get(key) is None
+        cluster[key] = key  # ignored
+        with pytest.raises(KeyError):
+            del cluster[key]
+    assert down_name in cluster.down_until
+    values = cluster.get_many(keys)
+    assert values == [
+        None if k in on_down_node else k for k in keys
+    ]
+    assert len(cluster) == len(keys) - len(on_down_node)
+
+
+def test_cache():
+    cluster = ClusterStorage([memory_storage(), memory_storage()], max_workers=0)
+    call_count = 0
+
+    @Cache(storage=cluster)
+    def func(a):
+        nonlocal call_count
+        call_count += 1
+        return a
+
+    assert [func(i) for i in range(10)] == [func(i) for i in range(10)]
+    assert call_count == 10
+    assert len(cluster) == 10
+
+
+def test_keys_do_not_fetch_values():
+    class KeysOnly(SQLiteStorage):
+        def items(self, **kwargs):
+            raise AssertionError('values fetched')
+
+    nodes = {
+        str(i): KeysOnly(filepath=':memory:', ttl=-1, maxsize=100)
+        for i in range(3)
+    }
+    cluster = ClusterStorage(nodes, max_workers=0)
+    cluster.set_many((k, k) for k in keys[:30])
+    assert sorted(cluster.keys()) == sorted(keys[:30])
@@ -0,0 +1,109 @@
+import array
+import gc
+import multiprocessing
+import os
+
+import pytest
+
+from caching import Cache, fingerprint_key, identity_key
+from caching.keys import fingerprint
+
+
+class Arg:
+    pass
+
+
+def test_identity_key():
+    a, b = Arg(), Arg()
+    assert identity_key(a, 1) == identity_key(a, 1)
+    assert identity_key(a, 1) != identity_key(b, 1)
+    assert identity_key(x=[1]) == identity_key(x=[1])
+    assert list(identity_key.referents((a, 1, [2]), {'x': b})) == [a, b]
+
+
+def test_identity_key_entries_die_with_arguments():
+    cache = Cache(key=identity_key)
+    call_count = 0
+
+    @cache
+    def func(obj, n):
+        nonlocal call_count
+        call_count += 1
+        return n
+
+    a, b = Arg(), Arg()
+    assert func(a, 1) == func(a, 1) == 1
+    assert func(b, 2) == 2
+    assert func(a, n=3) == 3
+    assert call_count == 3
+    assert len(cache) == 3
+
+    del a
+    gc.collect()
+    assert func(b, 2) == 2
+    assert call_count == 3
+    assert len(cache) == 1
+
+
+def test_fingerprint():
+    a = array.array('d', [1, 2, 3])
+    b = array.array('d', [1, 2, 3])
+    c = array.array('d', [1, 2, 4])
+    assert fingerprint(a) == fingerprint(b) != fingerprint(c)
+    assert fingerprint(array.array('q', [1, 2, 3])) != fingerprint(a)
+    # not contiguous
+    assert fingerprint(memoryview(a)[::2]) == fingerprint(
+        memoryview(array.array('d', [1, 3])),
+    )
+    assert fingerprint('abc') == 'abc'
+
+
+def test_fingerprint_key():
+    cache = Cache(key=fingerprint_key)
+    call_count = 0
+
+    @cache
+    def total(values, start=0):
+        nonlocal call_count
+        call_count += 1
+        return sum(values, start)
+
+    assert total(array.array('d', [1, 2, 3])) == 6
+    assert total(array.array('d', [1, 2, 3])) == 6
+    assert call_count == 1
+    assert total(array.array('d', [1, 2, 3]), start=1) == 7
+    assert total(bytearray(b'\x01\x02')) == 3
+    assert call_count == 3
+
+
+class Named:
+    def __init__(self, name):
+        self.name = name
+
+
+def _call_in_forks(func, names):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    results = []
+    for name in names:
+        # One after another, so the objects get the same ids in the children
+        process = context.Process(
+            target=lambda: queue.put(func(Named(name))),
+        )
+        process.start()
+        results.append(queue.get(timeout=10))
+        process.join()
+    return results
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'fork'), reason='fork is not available',
+)
+def test_identity_key_shared_file(tmpdir):
+    cache = Cache(filepath=f'{tmpdir}/cache', key=identity_key)
+
+    @cache
+    def name(obj):
+        return obj.name
+
+    assert _call_in_forks(name, ['alice', 'bob']) == ['alice', 'bob']
@@ -26,4 +26,5 @@ def test_readme():
         return x * 2
 
     for code in codes:
-        exec(code)
+        # A globals dict is passed so the names are visible in class bodies
+        exec(code, {'calculate_result': calculate_result})
@@ -0,0 +1,148 @@
+import threading
+import time
+
+from caching import Cache, Refresher
+from caching.cache import NegativeEntry, _function_name
+
+
+def make_cache(**kwargs):
+    refresher = Refresher(refresh_ahead=0.8, min_hits=1, **kwargs)
+    return Cache(ttl=1, refresher=refresher), refresher
+
+
+def counting_function(cache):
+    calls = []
+
+    @cache
+    def func(a):
+        calls.append(threading.current_thread().name)
+        return len(calls)
+
+    return func, calls
+
+
+def test_refresh_hot_key():
+    cache, refresher = make_cache()
+    func, calls = counting_function(cache)
+    assert func(1) == 1
+    assert func(1) == 1  # a hit
+    time.sleep(0.3)
+    cache.refresh()
+    refresher.wait()
+    assert calls[-1].startswith('caching-refresher')
+    # The refreshed result is stored on the next call
+    assert func(1) == 2
+    time.sleep(0.8)
+    # Would have expired without the refresh
+    assert func(1) == 2
+    refresher.wait()
+    assert calls.count('MainThread') == 1
+    cache.close()
+
+
+def test_cold_key_not_refreshed():
+    cache, refresher = make_cache()
+    func, calls = counting_function(cache)
+    func(1)
+    time.sleep(0.3)
+    cache.refresh()
+    refresher.wait()
+    assert len(calls) == 1
+    assert not refresher.entries
+    cache.close()
+
+
+def test_refresh_budget():
+    cache, refresher = make_cache(budget=1)
+    func, calls = counting_function(cache)
+    func(1), func(1), func(2), func(2)
+    time.sleep(0.3)
+    cache.refresh()
+    refresher.wait()
+    assert len(calls) == 3
+    cache.close()
+
+
+def test_refresh_max_pending():
+    cache, refresher = make_cache(max_pending=1)
+    event = threading.Event()
+
+    @cache
+    def func(a):
+        event.wait(5)
+        return a
+
+    event.set()
+    func(1), func(1), func(2), func(2)
+    event.clear()
+    time.sleep(0.3)
+    cache.refresh()
+    assert len(refresher.pending) == 1
+    event.set()
+    refresher.wait()
+    cache.close()
+
+
+def test_refresh_exception_forgets_key():
+    cache, refresher = make_cache()
+    fail = []
+
+    @cache
+    def func(a):
+        if fail:
+            raise ValueError
+        return a
+
+    func(1), func(1)
+    fail.append(True)
+    time.sleep(0.3)
+    cache.refresh()
+    refresher.wait()
+    cache.refresh()
+    assert not refresher.entries
+    assert func(1) == 1
+    cache.close()
+
+
+def test_refresh_negative_result_forgets_key():
+    refresher = Refresher(refresh_ahead=0.8, min_hits=1)
+    cache = Cache(
+        ttl=1, refresher=refresher, negative_results=(None,), negative_ttl=60,
+    )
+    missing = []
+
+    @cache
+    def func(a):
+        return None if missing else a
+
+    func(1), func(1)
+    missing.append(True)
+    time.sleep(0.3)
+    cache.refresh()
+    refresher.wait()
+    cache.refresh()
+    assert not refresher.entries
+    # The result stored before the refresh is kept until it expires
+    assert func(1) == 1
+    time.sleep(0.8)
+    assert func(1) is None
+    data = cache.storage.get(cache.encode((_function_name(func), 1)))
+    assert isinstance(cache.decode(data), NegativeEntry)
+    cache.close()
+
+
+def test_no_refresh_without_ttl():
+    refresher = Refresher(min_hits=1)
+    cache = Cache(refresher=refresher)
+    func, calls = counting_function(cache)
+    func(1), func(1)
+    assert not refresher.entries
+    cache.close()
+
+
+def test_max_keys():
+    cache, refresher = make_cache(max_keys=1)
+    func, calls = counting_function(cache)
+    func(1), func(2)
+    assert len(refresher.entries) == 1
+    cache.close()
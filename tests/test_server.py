@@ -0,0 +1,170 @@
+import os
+import threading
+
+import pytest
+
+from caching import Cache, MemoryStorage, SQLiteStorage
+from caching.remote import RemoteStorage
+from caching.server import CacheServer
+
+
+@pytest.fixture(params=['tcp', 'unix'])
+def server(tmpdir, request):
+    storage = SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=100)
+    path = f'{tmpdir}/socket' if request.param == 'unix' else None
+    with CacheServer(storage, path=path) as server:
+        yield server
+
+
+@pytest.fixture
+def storage(server):
+    storage = RemoteStorage(server.address, batch_size=3, timeout=5)
+    yield storage
+    storage.close()
+
+
+def test_set_get_del(storage):
+    assert storage.get(b'1') is None
+    no = object()
+    assert storage.get(b'1', no) is no
+    with pytest.raises(KeyError):
+        storage[b'1']
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    storage[b'2'] = b''
+    assert storage[b'2'] == b''
+    assert len(storage) == 2
+    del storage[b'1']
+    with pytest.raises(KeyError):
+        del storage[b'1']
+    storage.clear()
+    assert len(storage) == 0
+
+
+def test_many(storage):
+    items = [(b'%d' % i, b'v%d' % i) for i in range(10)]
+    storage.set_many(items, tag='t')
+    assert storage.get_many([k for k, v in items]) == [v for k, v in items]
+    assert storage.get_many([b'1', b'x', b'2'], b'-') == [b'v1', b'-', b'v2']
+    assert storage.get_many([]) == []
+    assert list(storage.items(tag='t')) == items
+    assert list(storage.keys()) == [k for k, v in items]
+    assert list(storage.values(tag='other')) == []
+    storage.invalidate('t')
+    assert storage.get_many([b'1']) == [None]
+
+
+@pytest.mark.parametrize('backend', [SQLiteStorage, MemoryStorage])
+def test_items_paged(backend):
+    if backend is SQLiteStorage:
+        served = SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=100)
+    else:
+        served = MemoryStorage(ttl=-1, maxsize=100)
+    pages = []
+    select_page = served.select_page
+
+    def recording_select_page(*args, **kwargs):
+        rows = select_page(*args, **kwargs)
+        pages.append(len(rows))
+        return rows
+
+    served.select_page = recording_select_page
+    items = [(b'%d' % i, b'v%d' % i) for i in range(10)]
+
+    with CacheServer(served) as server:
+        storage = RemoteStorage(server.address, timeout=5)
+        # Some of the items have the same timestamp
+        storage.set_many(items[:5], tag='t')
+        for key, value in items[5:]:
+            storage.set(key, value, tag='t')
+        assert list(storage.items(batch_size=4)) == items
+        assert pages == [4, 4, 2]
+        assert list(storage.keys(tag='t', batch_size=5)) == [
+            k for k, v in items
+        ]
+        assert list(storage.values(batch_size=100)) == [v for k, v in items]
+        storage.close()
+
+
+def test_server_error(storage):
+    with pytest.raises(RuntimeError):
+        storage.set(b'1', None)
+    # The connection is still usable
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+
+
+def test_pool(storage):
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(20):
+                key = b'%d-%d' % (n, i)
+                storage[key] = key
+                assert storage[key] == key
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(storage) == 100
+    assert storage.pool.qsize() <= storage.pool_size
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'fork'), reason='fork is not available',
+)
+def test_fork(storage):
+    storage[b'parent'] = b'parent'
+    storage[b'child'] = b'child'
+    assert storage.pool.qsize() == 1
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            assert storage.pool.qsize() == 0
+            for _ in range(300):
+                assert storage[b'child'] == b'child'
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+
+    for _ in range(300):
+        assert storage[b'parent'] == b'parent'
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_cache(server):
+    call_count = 0
+    with Cache(storage=RemoteStorage(server.address)) as cache:
+
+        @cache
+        def func(a):
+            nonlocal call_count
+            call_count += 1
+            return [a]
+
+        assert func(1) == func(1) == [1]
+        assert call_count == 1
+        cache.invalidate(func)
+        assert func(1) == [1]
+        assert call_count == 2
+
+    # Another client sees the results
+    with Cache(storage=RemoteStorage(server.address)) as cache:
+        assert list(cache.values()) == [[1]]
+
+
+def test_server_down(server):
+    storage = RemoteStorage(server.address)
+    storage[b'1'] = b'one'
+    server.close()
+    with pytest.raises(OSError):
+        storage.get(b'1')
+    with pytest.raises(OSError):
+        storage.get(b'1')
@@ -0,0 +1,170 @@
+import os
+import time
+
+import pytest
+
+from caching import Cache
+from caching.__main__ import main
+from caching.cache import _function_name
+from caching.stats import FunctionStats, format_report, read_stats
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+def test_function_stats():
+    cache = Cache(stats=True)
+
+    @cache
+    def slow(a):
+        time.sleep(0.01)
+        return 'x' * a
+
+    @cache
+    def unused(a):
+        return a
+
+    slow(10), slow(10), slow(10), slow(20)
+    stats = cache.get_stats()
+    assert set(stats) == {_function_name(slow), _function_name(unused)}
+    s = stats[_function_name(slow)]
+    assert (s.hits, s.misses) == (2, 2)
+    assert s.hit_ratio == 0.5
+    assert s.compute_time >= 0.02
+    assert s.avg_compute_time == s.compute_time / 2
+    assert s.time_saved == 2 * s.avg_compute_time
+    assert s.value_bytes == len(cache.encode('x' * 10)) + len(cache.encode('x' * 20))
+    assert stats[_function_name(unused)] == FunctionStats()
+
+
+def test_stats_disabled():
+    cache = Cache()
+
+    @cache
+    def func(a):
+        return a
+
+    func(1), func(1)
+    assert cache.get_stats() == {}
+
+
+def test_stats_negative_hits():
+    cache = Cache(stats=True, negative_results=(None,))
+
+    @cache
+    def func(a):
+        return None
+
+    func(1), func(1)
+    s = cache.get_stats()[_function_name(func)]
+    assert (s.hits, s.misses, s.value_bytes) == (1, 1, 0)
+
+
+def test_stats_saved(cache_file):
+    def func(a):
+        return a
+
+    # The results of the first session are hits in the second one
+    for hits in ([1, 2], [5, 6]):
+        with Cache(filepath=cache_file, stats=True) as cache:
+            f = cache(func)
+            f(1), f(1), f(2)
+            cache.flush()
+            assert cache.get_stats()[_function_name(func)].hits == hits[0]
+            f(1)
+            assert cache.get_stats()[_function_name(func)].hits == hits[1]
+
+    s = read_stats(cache_file)[_function_name(func)]
+    assert (s.hits, s.misses) == (6, 2)
+
+
+def test_stats_saved_periodically(cache_file):
+    cache = Cache(filepath=cache_file, stats=True)
+    cache.stats_save_interval = 0
+
+    @cache
+    def func(a):
+        return a
+
+    func(1)
+    assert cache.storage.load_stats()[_function_name(func)][1] == 1
+    cache.close()
+
+
+def test_stats_saved_periodically_on_hits(cache_file):
+    cache = Cache(filepath=cache_file, stats=True)
+
+    @cache
+    def func(a):
+        return a
+
+    func(1)
+    cache.flush()
+    cache.stats_save_interval = 0
+    func(1)
+    assert cache.storage.load_stats()[_function_name(func)][:2] == (1, 1)
+    cache.close()
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'fork'), reason='fork is not available',
+)
+def test_stats_after_fork(cache_file):
+    cache = Cache(filepath=cache_file, stats=True)
+
+    @cache
+    def func(a):
+        return a
+
+    for i in range(10):
+        func(i)
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            func(10)
+            cache.flush()
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+
+    assert os.waitpid(pid, 0)[1] == 0
+    cache.close()
+    assert read_stats(cache_file)[_function_name(func)].misses == 11
+
+
+def test_read_stats_without_stats(cache_file):
+    with Cache(filepath=cache_file) as cache:
+        cache[1] = 1
+    assert read_stats(cache_file) == {}
+
+
+def test_format_report():
+    report = format_report({
+        'a.cold': FunctionStats(0, 10, 1.0, 1000),
+        'a.hot': FunctionStats(90, 10, 2.0, 100),
+    })
+    lines = report.splitlines()
+    assert lines[0].split()[0] == 'function'
+    assert lines[1].split() == [
+        'a.hot', '90', '10', '90.0%', '0.200000', '10', '100', '18.000',
+    ]
+    assert lines[2].startswith('a.cold')
+
+
+def test_cli(cache_file, capsys):
+    with Cache(filepath=cache_file, stats=True) as cache:
+        @cache
+        def func(a):
+            return a
+
+        func(1), func(1)
+
+    assert main(['stats', cache_file]) == 0
+    out = capsys.readouterr().out
+    assert _function_name(func) in out
+
+    assert main(['stats', cache_file + '.missing']) == 1
+    os.remove(cache_file)
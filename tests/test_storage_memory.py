@@ -0,0 +1,222 @@
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+from caching import Cache, MemoryStorage, SQLiteStorage
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage(ttl=60, maxsize=100)
+
+
+def test_repr():
+    storage = MemoryStorage(maxsize=1, ttl=1)
+    assert repr(storage) == "MemoryStorage(maxsize=1, ttl=1, policy='FIFO')"
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        MemoryStorage(policy='MRU')
+
+
+def test_set_get(storage):
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    with pytest.raises(KeyError):
+        storage[b'2']
+    no = object()
+    assert storage.get(b'3') is None
+    assert storage.get(b'3', no) is no
+    del storage[b'1']
+    assert storage.get(b'1') is None
+    with pytest.raises(KeyError):
+        del storage[b'1']
+
+
+def test_ttl():
+    storage = MemoryStorage(ttl=0.1, maxsize=10)
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    time.sleep(0.15)
+    assert storage.get(b'1') is None
+    assert len(storage) == 0
+
+    # Expired items are deleted when new ones are stored
+    storage[b'1'] = b'one'
+    storage[b'2'] = b'two'
+    time.sleep(0.15)
+    storage[b'3'] = b'three'
+    assert len(storage) == 1
+
+
+@pytest.mark.parametrize('policy, evicted', [
+    ('FIFO', b'1'),
+    ('LRU', b'3'),
+    # Same as SQLiteStorage: the new item is used the least
+    ('LFU', b'4'),
+])
+def test_maxsize(policy, evicted):
+    storage = MemoryStorage(ttl=-1, maxsize=3, policy=policy)
+    storage[b'1'] = b'one'
+    storage[b'2'] = b'two'
+    storage[b'3'] = b'three'
+    storage.get(b'1')
+    storage.get(b'3')
+    storage.get(b'1')
+    storage.get(b'2')
+    storage[b'4'] = b'four'
+    assert sorted(storage.keys()) == sorted(
+        {b'1', b'2', b'3', b'4'} - {evicted}
+    )
+
+
+def test_lfu_heap_is_compacted():
+    storage = MemoryStorage(ttl=-1, maxsize=10, policy='LFU')
+    storage[b'1'] = b'one'
+    for _ in range(1000):
+        storage.get(b'1')
+        storage[b'2'] = b'two'
+    assert len(storage.heap) <= 2 * len(storage) + 17
+    assert storage[b'1'] == b'one'
+
+
+def test_lfu_heap_is_compacted_on_hits():
+    storage = MemoryStorage(ttl=-1, maxsize=100, policy='LFU')
+    for i in range(10):
+        storage[str(i).encode()] = b'value'
+    usage = storage.memory_usage()
+    for _ in range(10000):
+        for i in range(10):
+            storage.get(str(i).encode())
+    assert len(storage.heap) <= 2 * len(storage) + 17
+    assert storage.memory_usage() < 2 * usage
+    storage.evict_lfu(1)
+    assert len(storage) == 9
+
+
+@pytest.mark.parametrize('policy', ['FIFO', 'LRU', 'LFU'])
+def test_invalidated_evicted_first(policy):
+    storage = MemoryStorage(ttl=-1, maxsize=3, policy=policy)
+    for key in (b'a', b'b', b'c'):
+        storage.set(key, key, tag='t')
+        assert storage[key] == key
+    storage.invalidate('t')
+    for key in (b'd', b'e', b'f'):
+        storage[key] = key
+    assert len(storage) == 3
+    assert list(storage.keys()) == [b'd', b'e', b'f']
+
+
+def test_invalidate(storage):
+    storage.set(b'1', b'one', tag='a')
+    storage.set(b'2', b'two', tag='b')
+    storage[b'3'] = b'three'
+    storage.invalidate('a', 'c')
+    assert storage.get(b'1') is None
+    assert storage[b'2'] == b'two'
+    assert storage[b'3'] == b'three'
+    storage.set(b'1', b'one', tag='a')
+    assert storage[b'1'] == b'one'
+
+
+def test_items(storage):
+    storage.set(b'2', b'two', tag='a')
+    storage.set(b'1', b'one')
+    storage.set(b'3', b'three', tag='b')
+    storage.invalidate('b')
+    assert list(storage.items()) == [(b'2', b'two'), (b'1', b'one')]
+    assert list(storage.keys(tag='a')) == [b'2']
+    assert list(storage.values(tag='x')) == []
+    assert list(storage.items(max_age=-1)) == []
+
+
+def test_clear(storage):
+    storage[b'1'] = b'one'
+    storage.clear()
+    assert len(storage) == 0
+    assert storage.get(b'1') is None
+
+
+@pytest.mark.parametrize('policy', ['FIFO', 'LRU', 'LFU'])
+def test_dump_load(tmpdir, policy):
+    snapshot = f'{tmpdir}/snapshot'
+    source = MemoryStorage(ttl=60, maxsize=10, policy=policy)
+    source[b'1'] = b'one'
+    source.set(b'2', b'two', tag='a')
+    source.set(b'3', b'three', tag='b')
+    source.invalidate('b')
+    source.get(b'1')
+    source.dump(snapshot)
+
+    target = MemoryStorage(ttl=60, maxsize=10, policy=policy)
+    target[b'4'] = b'four'
+    target.load(snapshot)
+    assert target[b'1'] == b'one'
+    assert target[b'2'] == b'two'
+    assert target.get(b'3') is None
+    assert target[b'4'] == b'four'
+    assert list(target.keys(tag='a')) == [b'2']
+    assert list(target.keys())[:2] == list(source.keys())[:2]
+
+    # The snapshots are interchangeable with SQLiteStorage ones
+    sqlite_storage = SQLiteStorage(
+        filepath=':memory:', ttl=60, maxsize=10, policy=policy,
+    )
+    sqlite_storage.load(snapshot)
+    assert list(sqlite_storage.items()) == list(source.items())
+    sqlite_storage.dump(snapshot)
+    target = MemoryStorage(ttl=60, maxsize=10, policy=policy)
+    target.load(snapshot)
+    assert list(target.items()) == list(source.items())
+
+
+def test_load_applies_maxsize(tmpdir):
+    snapshot = f'{tmpdir}/snapshot'
+    source = MemoryStorage(ttl=-1, maxsize=10)
+    for i in range(5):
+        source[str(i).encode()] = b'x'
+    source.dump(snapshot)
+    target = MemoryStorage(ttl=-1, maxsize=2)
+    target.load(snapshot)
+    assert list(target.keys()) == [b'3', b'4']
+
+
+@pytest.mark.parametrize('policy', ['FIFO', 'LRU', 'LFU'])
+def test_memory_usage(policy):
+    tracemalloc.start()
+    storage = MemoryStorage(ttl=-1, maxsize=-1, policy=policy)
+    for i in range(10000):
+        storage.set(b'key%d' % i, b'value' * (i % 10), tag=f'tag{i % 3}')
+        if i % 2:
+            storage.get(b'key%d' % i)
+    traced, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert storage.memory_usage() == pytest.approx(traced, rel=0.1)
+
+
+def test_sqlite_memory_usage():
+    storage = SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=-1)
+    empty = storage.memory_usage()
+    for i in range(1000):
+        storage[b'key%d' % i] = b'value' * 100
+    assert storage.memory_usage() > empty + 1000 * 500
+
+
+def test_cache():
+    cache = Cache(storage=MemoryStorage(maxsize=10))
+
+    @cache
+    def func(a):
+        return [a]
+
+    assert func(1) is not func(1)
+    assert func(1) == [1]
+    assert len(cache) == 1
+    assert cache.memory_usage() > sys.getsizeof(cache.storage.records)
+    cache.invalidate(func)
+    assert 1 not in cache
@@ -1,4 +1,5 @@
 import os
+import sqlite3
 
 import pytest
 import time
@@ -44,6 +45,235 @@ def test_set_get(storage):
         del storage[b'1']
 
 
+@pytest.mark.parametrize('policy', ['FIFO', 'LRU', 'LFU'])
+def test_get_releases_lock(tmpdir, policy):
+    filepath = f'{tmpdir}/cache'
+    storage = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10, policy=policy)
+    other = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10, policy=policy)
+    other.db.execute('PRAGMA busy_timeout = 0')
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    assert storage.get(b'2') is None
+    other[b'2'] = b'two'
+    assert storage[b'2'] == b'two'
+
+
+def test_cached_statements(tmpdir):
+    storage = SQLiteStorage(
+        filepath=f'{tmpdir}/cache', ttl=-1, maxsize=10, cached_statements=10,
+    )
+    assert storage.cached_statements == 10
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'register_at_fork'), reason='fork is not available',
+)
+@pytest.mark.parametrize('filepath', ['file', ':memory:'])
+def test_after_fork(tmpdir, filepath):
+    if filepath == 'file':
+        filepath = f'{tmpdir}/cache'
+    storage = SQLiteStorage(
+        filepath=filepath, ttl=-1, maxsize=10, write_behind=True,
+    )
+    storage[b'1'] = b'one'
+    storage.flush()
+    storage[b'2'] = b'two'
+    parent_db = storage.db
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            in_memory = filepath == ':memory:'
+            assert (storage.db is parent_db) == in_memory
+            assert storage[b'1'] == b'one'
+            assert (storage.get(b'2') == b'two') == in_memory
+            storage[b'3'] = b'three'
+            storage.close()
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+
+    assert os.waitpid(pid, 0)[1] == 0
+    assert storage.db is parent_db
+    assert storage[b'2'] == b'two'
+    if filepath != ':memory:':
+        assert storage[b'3'] == b'three'
+    else:
+        assert storage.get(b'3') is None
+
+
+def test_after_fork_not_connected(tmpdir):
+    storage = SQLiteStorage(
+        filepath=f'{tmpdir}/cache', ttl=-1, maxsize=10, write_behind=True,
+        flush_interval=60,
+    )
+    storage[b'1'] = b'one'
+    assert not storage.connected
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        # The queued item is left for the parent to flush
+        os._exit(0 if not storage.pending else 1)
+
+    assert os.waitpid(pid, 0)[1] == 0
+    assert storage.pending
+
+
+def test_lazy_init(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    storage = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10)
+    assert not storage.connected
+    assert storage.get(b'1') is None
+    assert storage.connected
+    assert storage.db.execute('PRAGMA user_version').fetchone() == (
+        SQLiteStorage.SCHEMA_VERSION,
+    )
+    storage.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        storage.get(b'1')
+
+    never_used = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10)
+    never_used.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        never_used[b'1'] = b'one'
+
+
+def test_lazy_init_retried(tmpdir):
+    storage = SQLiteStorage(filepath=f'{tmpdir}/cache', ttl=-1, maxsize=10)
+    init_db = storage.init_db
+
+    def locked():
+        storage.init_db = init_db
+        raise sqlite3.OperationalError('database is locked')
+
+    storage.init_db = locked
+    with pytest.raises(sqlite3.OperationalError):
+        storage.get(b'1')
+    assert not storage.connected
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    storage.close()
+
+
+def test_schema_not_recreated(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    with SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10) as storage:
+        with storage.db as db:
+            db.execute('DROP INDEX i_cache_ts')
+    with SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10) as storage:
+        assert not storage.db.execute(
+            "SELECT * FROM sqlite_master WHERE name = 'i_cache_ts'"
+        ).fetchall()
+
+
+def test_schema_meta(tmpdir):
+    with SQLiteStorage(
+        filepath=f'{tmpdir}/cache', ttl=10, maxsize=5, policy='LRU',
+        serializer='pickle',
+    ) as storage:
+        meta = dict(storage.db.execute('SELECT key, value FROM cache_meta'))
+        assert meta == {
+            'count': 0,
+            'schema_version': SQLiteStorage.SCHEMA_VERSION,
+            'policy': 'LRU',
+            'ttl': 10,
+            'maxsize': 5,
+            'serializer': 'pickle',
+        }
+
+
+def columns(storage):
+    return [row[1] for row in storage.db.execute('PRAGMA table_info(cache)')]
+
+
+def test_migrate_policy(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    with SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10) as storage:
+        storage[b'1'] = b'one'
+        storage[b'2'] = b'two'
+        assert 'used' not in columns(storage)
+
+    with SQLiteStorage(
+        filepath=filepath, ttl=-1, maxsize=10, policy='LFU',
+    ) as storage:
+        assert 'used' in columns(storage)
+        ensure_index(storage.db, 'cache', ['used', 'ts'], False)
+        assert storage[b'1'] == b'one'
+        assert storage.db.execute(
+            'SELECT used FROM cache WHERE key = ?', (b'1',),
+        ).fetchone() == (1,)
+
+    with SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10) as storage:
+        assert 'used' not in columns(storage)
+        ensure_index(storage.db, 'cache', ['ts'], False)
+        assert list(storage.items()) == [(b'1', b'one'), (b'2', b'two')]
+        assert len(storage) == 2
+        storage[b'3'] = b'three'
+        assert len(storage) == 3
+
+
+def test_migrate_maxsize_and_ttl(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    with SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10) as storage:
+        for i in range(5):
+            storage[b'%d' % i] = b''
+        with storage.db as db:
+            db.execute('UPDATE cache SET ts = ts - 100 WHERE key = ?', (b'4',))
+
+    with SQLiteStorage(filepath=filepath, ttl=50, maxsize=3) as storage:
+        keys = list(storage.keys())
+        assert len(keys) == len(storage) == 3
+        assert b'4' not in keys  # expired
+        for i in range(5, 10):
+            storage[b'%d' % i] = b''
+        assert len(list(storage.keys())) == len(storage) == 3
+        assert storage[b'9'] == b''
+
+
+def test_migrate_serializer(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    with SQLiteStorage(
+        filepath=filepath, ttl=-1, maxsize=10, serializer='pickle',
+    ) as storage:
+        storage[b'1'] = b'one'
+    with SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10) as storage:
+        assert storage[b'1'] == b'one'
+    with SQLiteStorage(
+        filepath=filepath, ttl=-1, maxsize=10, serializer='json',
+    ) as storage:
+        assert storage.get(b'1') is None
+        assert len(storage) == 0
+
+
+def test_migrate_legacy_schema(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    db = sqlite3.connect(filepath)
+    db.execute('''
+        CREATE TABLE cache (
+            key BINARY PRIMARY KEY,
+            ts REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5)*86400.0),
+            used INT NOT NULL DEFAULT 0,
+            value BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    db.execute('CREATE INDEX i_cache_ts ON cache (ts)')
+    db.execute('CREATE INDEX i_cache_0 ON cache (used, ts)')
+    db.execute("INSERT INTO cache (key, value) VALUES (x'31', 'one')")
+    db.commit()
+    db.close()
+
+    with SQLiteStorage(
+        filepath=filepath, ttl=-1, maxsize=10, policy='LRU',
+    ) as storage:
+        assert storage[b'1'] == 'one'
+        assert len(storage) == 1
+        storage.set(b'2', b'two', tag='t')
+        storage.invalidate('t')
+        assert storage.get(b'2') is None
+
+
 def test_ttl_gt0(tmpdir):
     storage = SQLiteStorage(
         filepath=f'{tmpdir}/cache',
@@ -80,6 +310,72 @@ def test_ttl_lte0(tmpdir, ttl):
         assert storage.get(b'1') == b'one'
 
 
+def test_write_behind(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    storage = SQLiteStorage(
+        filepath=filepath,
+        ttl=-1,
+        maxsize=100,
+        write_behind=True,
+        flush_count=100,
+        flush_interval=60,
+    )
+    other = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=100)
+
+    storage[b'1'] = b'one'
+    assert storage[b'1'] == b'one'
+    assert other.get(b'1') is None
+
+    storage.flush()
+    assert other[b'1'] == b'one'
+
+    storage[b'2'] = b'two'
+    del storage[b'1']
+    assert other.get(b'1') is None
+    assert other[b'2'] == b'two'
+
+    storage[b'3'] = b'three'
+    storage.flush_interval = 0
+    storage[b'4'] = b'four'
+    assert other[b'3'] == b'three'
+    assert other[b'4'] == b'four'
+
+    storage[b'5'] = b'five'
+    storage.close()
+    assert other[b'5'] == b'five'
+
+
+def test_write_behind_flush_interval_on_get(tmpdir):
+    filepath = f'{tmpdir}/cache'
+    storage = SQLiteStorage(
+        filepath=filepath,
+        ttl=-1,
+        maxsize=100,
+        write_behind=True,
+        flush_interval=0.05,
+    )
+    other = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=100)
+    storage[b'1'] = b'one'
+    time.sleep(0.1)
+    assert storage.pending
+    # A read flushes the items queued for longer than flush_interval
+    assert storage.get(b'2') is None
+    assert not storage.pending
+    assert other[b'1'] == b'one'
+
+
+def test_write_behind_ttl(tmpdir):
+    storage = SQLiteStorage(
+        filepath=f'{tmpdir}/cache',
+        ttl=0.001,
+        maxsize=100,
+        write_behind=True,
+    )
+    storage[b'1'] = b'one'
+    time.sleep(0.0011)
+    assert storage.get(b'1') is None
+
+
 def test_maxsize(tmpdir):
     with SQLiteStorage(
         filepath=f'{tmpdir}/cache',
@@ -119,11 +415,129 @@ def test_clear(storage):
     assert storage.get(b'2') is None
 
 
+def test_invalidate(storage):
+    storage.set(b'1', b'one', tag='a')
+    storage.set(b'2', b'two', tag='b')
+    storage[b'3'] = b'three'
+    storage.invalidate('a')
+    assert storage.get(b'1') is None
+    assert storage[b'2'] == b'two'
+    assert list(storage.items()) == [(b'2', b'two'), (b'3', b'three')]
+    storage.invalidate('a', 'b')
+    assert list(storage.items()) == [(b'3', b'three')]
+    storage.set(b'1', b'one', tag='a')
+    assert storage[b'1'] == b'one'
+
+
+@pytest.mark.parametrize('policy', ['FIFO', 'LRU', 'LFU'])
+def test_invalidated_evicted_first(tmpdir, policy):
+    storage = SQLiteStorage(
+        filepath=f'{tmpdir}/cache', ttl=-1, maxsize=3, policy=policy,
+    )
+    for key in (b'a', b'b', b'c'):
+        storage.set(key, key, tag='t')
+        assert storage[key] == key
+    storage.invalidate('t')
+    for key in (b'd', b'e', b'f'):
+        storage[key] = key
+    assert len(storage) == 3
+    assert list(storage.keys()) == [b'd', b'e', b'f']
+    storage.close()
+
+
+def test_invalidate_write_behind(tmpdir):
+    storage = SQLiteStorage(
+        filepath=f'{tmpdir}/cache',
+        ttl=-1,
+        maxsize=100,
+        write_behind=True,
+    )
+    storage.set(b'1', b'one', tag='a')
+    storage.set(b'2', b'two', tag='b')
+    storage.invalidate('a')
+    assert storage.get(b'1') is None
+    storage.flush()
+    assert storage.get(b'1') is None
+    assert storage[b'2'] == b'two'
+
+
+def test_dump_load(tmpdir):
+    snapshot = f'{tmpdir}/snapshot'
+    source = SQLiteStorage(filepath=':memory:', ttl=60, maxsize=3, policy='LFU')
+    source[b'1'] = b'one'
+    source.set(b'2', b'two', tag='a')
+    source.set(b'3', b'three', tag='b')
+    source.invalidate('b')
+    source.get(b'1')
+    source.dump(snapshot)
+    # The invalidated item is not loaded
+    source_rows = source.db.execute(
+        'SELECT key, ts, used FROM cache WHERE key != ? ORDER BY key', (b'3',),
+    ).fetchall()
+
+    target = SQLiteStorage(filepath=':memory:', ttl=60, maxsize=10, policy='LFU')
+    target[b'4'] = b'four'
+    target.load(snapshot)
+    assert target.db.execute(
+        'SELECT key, ts, used FROM cache WHERE key != ? ORDER BY key', (b'4',),
+    ).fetchall() == source_rows
+    assert target[b'1'] == b'one'
+    assert target[b'2'] == b'two'
+    assert target.get(b'3') is None
+    assert target[b'4'] == b'four'
+
+    # maxsize is applied after the load and the cleanup trigger is restored
+    target = SQLiteStorage(filepath=':memory:', ttl=60, maxsize=2, policy='LFU')
+    target.load(snapshot)
+    assert target.db.execute('SELECT count(*) FROM cache').fetchone() == (2,)
+    assert target[b'1'] == b'one'
+    target[b'5'] = b'five'
+    assert target.db.execute('SELECT count(*) FROM cache').fetchone() == (2,)
+    assert target[b'1'] == b'one'
+
+
+def test_load_after_invalidate(tmpdir):
+    snapshot = f'{tmpdir}/snapshot'
+    source = SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=10)
+    source.set(b'1', b'one', tag='users')
+    source.set(b'2', b'two', tag='old')
+    source.invalidate('old')
+    source.dump(snapshot)
+
+    target = SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=10)
+    target.set(b'3', b'three', tag='users')
+    target.invalidate('users')
+    target.load(snapshot)
+    assert target[b'1'] == b'one'
+    assert target.get(b'2') is None
+    assert target.get(b'3') is None
+    # The invalidated item of the snapshot is not copied
+    assert target.db.execute(
+        'SELECT key FROM cache ORDER BY key').fetchall() == [(b'1',), (b'3',)]
+    target.invalidate('users')
+    assert target.get(b'1') is None
+
+
+def test_load_other_policy(tmpdir):
+    snapshot = f'{tmpdir}/snapshot'
+    source = SQLiteStorage(filepath=snapshot, ttl=-1, maxsize=10, policy='LRU')
+    source[b'1'] = b'one'
+    source.close()
+
+    target = SQLiteStorage(filepath=':memory:', ttl=-1, maxsize=10)
+    target.load(snapshot)
+    assert list(target.items()) == [(b'1', b'one')]
+    ensure_index(target.db, 'cache', ['ts'], False)
+
+
 def test_remove(tmpdir):
     tmpdir = str(tmpdir)
     assert os.listdir(tmpdir) == []
     filepath = f'{tmpdir}/cache'
     storage = SQLiteStorage(filepath=filepath, ttl=-1, maxsize=10)
+    # The file is created lazily
+    assert os.listdir(tmpdir) == []
+    storage[b'1'] = b'one'
     assert os.path.isfile(filepath)
     assert os.listdir(tmpdir) == ['cache']
     storage.remove()
@@ -146,6 +560,32 @@ def test_items(storage):
     ]
 
 
+def test_items_batches(storage):
+    for i in range(10):
+        storage[b'%d' % i] = b'v%d' % i
+    with storage.db as db:
+        # the same ts for all the rows
+        db.execute('UPDATE cache SET ts = (SELECT max(ts) FROM cache)')
+    expected = [b'%d' % i for i in range(10)]
+    for batch_size in (1, 3, 10, 100):
+        assert list(storage.keys(batch_size=batch_size)) == expected
+    assert list(storage.values(batch_size=4))[-1] == b'v9'
+
+
+def test_len(tmpdir):
+    storage = SQLiteStorage(filepath=f'{tmpdir}/cache', ttl=-1, maxsize=3)
+    assert len(storage) == 0
+    storage[b'1'] = b'one'
+    storage[b'1'] = b'one'
+    assert len(storage) == 1
+    for i in range(10):
+        storage[b'%d' % i] = b''
+    assert len(storage) == 3
+    storage.close()
+    storage = SQLiteStorage(filepath=f'{tmpdir}/cache', ttl=-1, maxsize=3)
+    assert len(storage) == 3
+
+
 def ensure_index(db, table_name, columns, unique):
     columns = ', '.join(columns)
     unique = 'UNIQUE' if unique else ''
@@ -172,7 +612,8 @@ def test_schema_fifo():
     ensure_index(storage.db, 'cache', ['ts'], False)
     assert len(q(
         'SELECT * FROM SQLITE_MASTER '
-        "WHERE TYPE = 'trigger' AND tbl_name = 'cache'",
+        "WHERE TYPE = 'trigger' AND tbl_name = 'cache' "
+        "AND name = 't_cache_cleanup'",
     )) == 1
 
 
@@ -191,7 +632,8 @@ def test_schema_lru():
     ensure_index(storage.db, 'cache', ['used', 'ts'], False)
     assert len(q(
         'SELECT * FROM SQLITE_MASTER '
-        "WHERE TYPE = 'trigger' AND tbl_name = 'cache'",
+        "WHERE TYPE = 'trigger' AND tbl_name = 'cache' "
+        "AND name = 't_cache_cleanup'",
     )) == 1
 
 
@@ -210,5 +652,6 @@ def test_schema_lfu():
     ensure_index(storage.db, 'cache', ['used', 'ts'], False)
     assert len(q(
         'SELECT * FROM SQLITE_MASTER '
-        "WHERE TYPE = 'trigger' AND tbl_name = 'cache'",
+        "WHERE TYPE = 'trigger' AND tbl_name = 'cache' "
+        "AND name = 't_cache_cleanup'",
     )) == 1